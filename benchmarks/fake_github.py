@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""A local stand-in for the parts of the GitHub REST and GraphQL APIs that ghtt uses.
+
+Repositories are bare git repositories in a temporary directory. Their `ssh_url` and `clone_url`
+point to those directories, so ghtt can push to and fetch from them without SSH.
+"""
+import base64
+import hashlib
+import itertools
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+# Identity of the commits created through the Git Data API.
+_GIT_IDENTITY = {
+    "GIT_AUTHOR_NAME": "fake github", "GIT_AUTHOR_EMAIL": "fake@example.com",
+    "GIT_COMMITTER_NAME": "fake github", "GIT_COMMITTER_EMAIL": "fake@example.com",
+}
+
+
+class Repo:
+    def __init__(self, server: "FakeGitHub", org: str, name: str, description: str = "", has_issues: bool = True):
+        self.org = org
+        self.name = name
+        self.description = description
+        self.has_issues = has_issues
+        self.default_branch = "main"
+        self.path = os.path.join(server.directory, org, name + ".git")
+        self.collaborators: Dict[str, str] = {}
+        self.invitations: Dict[int, dict] = {}
+        self.milestones: List[dict] = []
+        self.issues: List[dict] = []
+        self.pulls: List[dict] = []
+        self.protected: Dict[str, dict] = {}
+        os.makedirs(self.path)
+        subprocess.check_call(["git", "init", "--quiet", "--bare", self.path])
+        self.set_default_branch(self.default_branch)
+
+    def set_default_branch(self, branch: str):
+        # HEAD of a GitHub repository is its default branch.
+        self.default_branch = branch
+        subprocess.check_call(["git", "symbolic-ref", "HEAD", "refs/heads/" + branch], cwd=self.path)
+
+    def json(self, gh: "FakeGitHub") -> dict:
+        return {
+            "id": abs(hash(self.path)) % 10 ** 9,
+            "name": self.name,
+            "full_name": "{}/{}".format(self.org, self.name),
+            "owner": {"login": self.org, "type": "Organization"},
+            "private": True,
+            "description": self.description,
+            "default_branch": self.default_branch,
+            "has_issues": self.has_issues,
+            "url": "{}/repos/{}/{}".format(gh.base, self.org, self.name),
+            "html_url": "{}/{}/{}".format(gh.url, self.org, self.name),
+            "ssh_url": self.path,
+            "clone_url": self.path,
+        }
+
+    def git(self, args: List[str], input: Optional[bytes] = None, env: Optional[dict] = None) -> str:
+        """Runs git in the repository. A failure is a 422, like GitHub's answer to invalid git data."""
+        result = subprocess.run(["git"] + args, cwd=self.path, input=input, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise _Response(422, {"message": result.stderr.decode("utf-8", "replace").strip()})
+        return result.stdout.decode().strip()
+
+    def write_tree(self, base_tree: Optional[str], entries: List[dict]) -> str:
+        """Creates a tree like `POST /git/trees`: the entries on top of `base_tree`."""
+        lines = []
+        for entry in entries:
+            if entry.get("sha", "") is None:  # deletes the path
+                lines.append("0 {}\t{}".format("0" * 40, entry["path"]))
+                continue
+            sha = entry.get("sha") or self.git(["hash-object", "-w", "--stdin"], input=entry["content"].encode("utf-8"))
+            lines.append("{} {}\t{}".format(entry["mode"], sha, entry["path"]))
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, GIT_INDEX_FILE=os.path.join(directory, "index"))
+            if base_tree:
+                self.git(["read-tree", base_tree], env=env)
+            self.git(["update-index", "--index-info"], input="".join(line + "\n" for line in lines).encode("utf-8"), env=env)
+            return self.git(["write-tree"], env=env)
+
+    def has_branch(self, branch: str) -> bool:
+        return subprocess.run(["git", "rev-parse", "--verify", "--quiet", "refs/heads/" + branch], cwd=self.path,
+                              stdout=subprocess.DEVNULL).returncode == 0
+
+    def head(self) -> Optional[dict]:
+        """Returns the head commit of the default branch in the shape of the GraphQL API."""
+        try:
+            output = subprocess.check_output(
+                ["git", "log", "-1", "--format=%H%x00%T%x00%s%x00%cI%x00%an%x00%ae%x00%aI",
+                 "refs/heads/" + self.default_branch, "--"],
+                cwd=self.path, stderr=subprocess.DEVNULL, universal_newlines=True)
+        except subprocess.CalledProcessError:
+            return None
+        if not output:
+            return None
+        sha, tree, subject, committed, name, email, authored = output.rstrip("\n").split("\0")
+        return {
+            "oid": sha, "tree": {"oid": tree}, "messageHeadline": subject, "committedDate": committed,
+            "author": {"name": name, "email": email, "date": authored},
+        }
+
+
+class FakeGitHub:
+    """The state of the fake GitHub, and the HTTP server that serves it.
+
+    `latency` is added to every request. `rate_limit` requests are allowed per `rate_window`
+    seconds; after that, requests fail with 403 until the window resets, like GitHub's primary rate
+    limit. The search API has its own budget of `search_rate_limit` requests per window.
+    """
+    def __init__(self, directory: str, latency: float = 0.0, rate_limit: int = 5000, rate_window: float = 3600,
+                 search_rate_limit: int = 30):
+        self.directory = directory
+        self.latency = latency
+        self.limits = {"core": rate_limit, "search": search_rate_limit, "graphql": rate_limit}
+        self.rate_window = rate_window
+        self.orgs: Dict[str, Dict[str, Repo]] = {}
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self._windows: Dict[str, List] = {}
+        self._ids = itertools.count(1)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+        self.base = self.url + "/api/v3"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def add_org(self, org: str):
+        self.orgs.setdefault(org, {})
+
+    def reset_counts(self) -> Dict[str, int]:
+        with self.lock:
+            counts, self.requests = self.requests, {}
+            return counts
+
+    def next_id(self) -> int:
+        with self.lock:
+            return next(self._ids)
+
+    def take(self, resource: str, charge: bool = True) -> tuple:
+        """Counts a request against the budget of a resource, unless `charge` is False. Returns
+        (allowed, limit, remaining, reset).
+        """
+        with self.lock:
+            now = time.time()
+            window = self._windows.get(resource)
+            if window is None or window[0] <= now:
+                window = self._windows[resource] = [now + self.rate_window, self.limits[resource]]
+            allowed = window[1] > 0
+            if allowed and charge:
+                window[1] -= 1
+            return allowed, self.limits[resource], window[1], int(window[0])
+
+    def count(self, key: str):
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+
+class _Response(Exception):
+    def __init__(self, status: int, body=None, headers: Optional[dict] = None):
+        super().__init__(status)
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+def _user(login: str) -> dict:
+    return {"login": login, "type": "User", "url": "/users/" + login}
+
+
+_PERMISSIONS = {
+    "pull": {"pull": True, "triage": False, "push": False, "maintain": False, "admin": False},
+    "push": {"pull": True, "triage": True, "push": True, "maintain": False, "admin": False},
+}
+
+
+def _handler(gh: FakeGitHub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.handle_request("GET")
+
+        def do_POST(self):
+            self.handle_request("POST")
+
+        def do_PATCH(self):
+            self.handle_request("PATCH")
+
+        def do_PUT(self):
+            self.handle_request("PUT")
+
+        def do_DELETE(self):
+            self.handle_request("DELETE")
+
+        def handle_request(self, method: str):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            url = urlparse(self.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            payload = json.loads(raw) if raw else {}
+            path = url.path
+            resource = "search" if path.startswith("/api/v3/search/") else "graphql" if path == "/api/graphql" else "core"
+
+            if gh.latency:
+                time.sleep(gh.latency)
+            gh.count("{} {}".format(method, _template(path)))
+
+            # GET requests have no side effects, so they are answered before the budget is charged:
+            # like on GitHub, a 304 Not Modified doesn't count against the rate limit.
+            if method == "GET":
+                status, body, headers = self.run(method, path, query, payload)
+                if "ETag" in headers and self.headers.get("If-None-Match") == headers["ETag"]:
+                    headers.update(self.rate_limit_headers(resource, charge=False)[1])
+                    return self.reply(304, None, headers)
+            allowed, rate_limit_headers = self.rate_limit_headers(resource)
+            if not allowed:
+                return self.reply(403, {"message": "API rate limit exceeded"}, rate_limit_headers)
+            if method != "GET":
+                status, body, headers = self.run(method, path, query, payload)
+            headers.update(rate_limit_headers)
+            self.reply(status, body, headers)
+
+        def run(self, method: str, path: str, query: dict, payload: dict) -> tuple:
+            """Routes the request. Returns the status, body and headers of the response."""
+            try:
+                status, body, headers = 200, route(self, method, path, query, payload), {}
+            except _Response as response:
+                status, body, headers = response.status, response.body, dict(response.headers)
+            if isinstance(body, tuple):  # a page of a list
+                body, link = body
+                if link:
+                    headers["Link"] = link
+            if status == 200 and method == "GET":
+                headers["ETag"] = '"{}"'.format(hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest())
+            return status, body, headers
+
+        def rate_limit_headers(self, resource: str, charge: bool = True) -> tuple:
+            allowed, limit, remaining, reset = gh.take(resource, charge)
+            return allowed, {
+                "X-RateLimit-Limit": str(limit), "X-RateLimit-Remaining": str(remaining),
+                "X-RateLimit-Reset": str(reset), "X-RateLimit-Resource": resource,
+            }
+
+        def reply(self, status: int, body, headers: dict):
+            data = b"" if body is None else json.dumps(body).encode()
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def page(self, items: list, query: dict):
+            per_page = int(query.get("per_page", 30))
+            number = int(query.get("page", 1))
+            chunk = items[(number - 1) * per_page:number * per_page]
+            link = None
+            if number * per_page < len(items):
+                next_query = dict(query, page=str(number + 1))
+                link = '<{}{}?{}>; rel="next"'.format(
+                    gh.url, urlparse(self.path).path, "&".join("{}={}".format(k, v) for k, v in next_query.items()))
+            return chunk, link
+
+        def repo(self, org: str, name: str) -> Repo:
+            repo = gh.orgs.get(org, {}).get(name.lower())
+            if repo is None:
+                raise _Response(404, {"message": "Not Found"})
+            return repo
+
+    def route(handler: Handler, method: str, path: str, query: dict, payload: dict):
+        base = gh.base
+        if path == "/api/graphql":
+            return _graphql(gh, payload["query"])
+        parts = path[len("/api/v3/"):].split("/") if path.startswith("/api/v3/") else []
+
+        if parts[:1] == ["orgs"] and len(parts) >= 2:
+            org = parts[1]
+            if org not in gh.orgs:
+                raise _Response(404, {"message": "Not Found"})
+            if len(parts) == 2:
+                return {"login": org, "url": "{}/orgs/{}".format(base, org), "html_url": "{}/{}".format(gh.url, org)}
+            if parts[2] == "repos" and method == "GET":
+                repos = sorted(gh.orgs[org].values(), key=lambda r: r.name)
+                return handler.page([r.json(gh) for r in repos], query)
+            if parts[2] == "repos" and method == "POST":
+                name = payload["name"]
+                with gh.lock:
+                    if name.lower() in gh.orgs[org]:
+                        raise _Response(422, {"message": "Repository creation failed.", "errors": [{"code": "custom", "message": "name already exists"}]})
+                    repo = gh.orgs[org][name.lower()] = Repo(gh, org, name, payload.get("description") or "", payload.get("has_issues", True))
+                raise _Response(201, repo.json(gh))
+            if parts[2] in ("outside_collaborators", "members"):
+                logins = set()
+                if parts[2] == "outside_collaborators":
+                    for repo in list(gh.orgs[org].values()):
+                        logins.update(repo.collaborators)
+                return handler.page([_user(login) for login in sorted(logins)], query)
+
+        if parts[:2] == ["user", "repository_invitations"]:
+            # Accepting or declining an invitation is only allowed for the invitee.
+            raise _Response(404, {"message": "Not Found"})
+
+        if parts[:1] == ["repos"] and len(parts) >= 3:
+            repo = handler.repo(parts[1], parts[2])
+            rest = parts[3:]
+            if not rest:
+                if method == "PATCH":
+                    repo.description = payload.get("description", repo.description)
+                    if payload.get("default_branch", repo.default_branch) != repo.default_branch:
+                        repo.set_default_branch(payload["default_branch"])
+                    if "name" in payload:
+                        with gh.lock:
+                            del gh.orgs[repo.org][repo.name.lower()]
+                            repo.name = payload["name"]
+                            gh.orgs[repo.org][repo.name.lower()] = repo
+                if method == "DELETE":
+                    with gh.lock:
+                        del gh.orgs[repo.org][repo.name.lower()]
+                    raise _Response(204)
+                return repo.json(gh)
+            if rest[0] == "branches" and rest[-1] == "protection" and method == "PUT":
+                repo.protected["/".join(rest[1:-1])] = payload
+                return {"url": path}
+            if rest[0] == "collaborators":
+                if method == "GET":
+                    return handler.page([dict(_user(login), permissions=_PERMISSIONS[p]) for login, p in sorted(repo.collaborators.items())], query)
+                login = rest[1]
+                if method == "PUT":
+                    if login in repo.collaborators:
+                        repo.collaborators[login] = payload.get("permission", "push")
+                        raise _Response(204)
+                    invitation_id = gh.next_id()
+                    invitation = {
+                        "id": invitation_id, "invitee": _user(login), "inviter": _user("teacher"),
+                        "permissions": "read" if payload.get("permission") == "pull" else "write",
+                        # Like GitHub, the url is the invitee's endpoint, not the repository's.
+                        "url": "{}/user/repository_invitations/{}".format(base, invitation_id),
+                        "repository": repo.json(gh),
+                    }
+                    repo.invitations[invitation_id] = invitation
+                    raise _Response(201, invitation)
+                if method == "DELETE":
+                    repo.collaborators.pop(login, None)
+                    raise _Response(204)
+            if rest[0] == "invitations":
+                if method == "GET":
+                    return handler.page(list(repo.invitations.values()), query)
+                invitation = repo.invitations.get(int(rest[1]))
+                if invitation is None:
+                    raise _Response(404, {"message": "Not Found"})
+                if method == "PATCH":
+                    invitation["permissions"] = payload["permissions"]
+                    return invitation
+                if method == "DELETE":
+                    del repo.invitations[invitation["id"]]
+                    raise _Response(204)
+            if rest[0] == "milestones":
+                if method == "GET":
+                    return handler.page(repo.milestones, query)
+                if method == "POST":
+                    number = len(repo.milestones) + 1
+                    milestone = {
+                        "number": number, "id": gh.next_id(), "title": payload["title"],
+                        "description": payload.get("description"), "due_on": payload.get("due_on"), "state": "open",
+                        "url": "{}/repos/{}/{}/milestones/{}".format(base, repo.org, repo.name, number),
+                    }
+                    repo.milestones.append(milestone)
+                    raise _Response(201, milestone)
+                if method == "PATCH":
+                    milestone = repo.milestones[int(rest[1]) - 1]
+                    milestone.update(payload)
+                    return milestone
+            if rest[0] == "issues":
+                if method == "GET":
+                    return handler.page(repo.issues, query)
+                if method == "POST":
+                    number = len(repo.issues) + 1
+                    issue = {
+                        "number": number, "id": gh.next_id(), "title": payload["title"], "body": payload.get("body"),
+                        "labels": [{"name": label} for label in payload.get("labels", [])],
+                        "assignees": [_user(login) for login in payload.get("assignees", [])],
+                        "milestone": next((m for m in repo.milestones if m["number"] == payload.get("milestone")), None),
+                        "state": "open",
+                        "url": "{}/repos/{}/{}/issues/{}".format(base, repo.org, repo.name, number),
+                    }
+                    repo.issues.append(issue)
+                    raise _Response(201, issue)
+            if rest[0] == "pulls" and method == "POST":
+                if not repo.has_branch(payload["head"]):
+                    raise _Response(422, {"message": "Validation Failed", "errors": [{"field": "head", "code": "invalid"}]})
+                number = len(repo.issues) + len(repo.pulls) + 1
+                pull = {"number": number, "id": gh.next_id(), "title": payload["title"], "state": "open",
+                        "head": {"ref": payload["head"]}, "base": {"ref": payload["base"]},
+                        "url": "{}/repos/{}/{}/pulls/{}".format(base, repo.org, repo.name, number),
+                        "html_url": "{}/{}/{}/pull/{}".format(gh.url, repo.org, repo.name, number)}
+                repo.pulls.append(pull)
+                raise _Response(201, pull)
+            if rest[0] == "git" and len(rest) == 2 and method == "POST":
+                url = "{}/repos/{}/{}/git/{}".format(base, repo.org, repo.name, rest[1])
+                if rest[1] == "blobs":
+                    content = payload["content"].encode("utf-8")
+                    if payload.get("encoding") == "base64":
+                        content = base64.b64decode(content)
+                    sha = repo.git(["hash-object", "-w", "--stdin"], input=content)
+                    raise _Response(201, {"sha": sha, "url": "{}/{}".format(url, sha)})
+                if rest[1] == "trees":
+                    sha = repo.write_tree(payload.get("base_tree"), payload["tree"])
+                    raise _Response(201, {"sha": sha, "url": "{}/{}".format(url, sha), "tree": [], "truncated": False})
+                if rest[1] == "commits":
+                    args = ["commit-tree", payload["tree"], "-m", payload["message"]]
+                    for parent in payload.get("parents", []):
+                        args += ["-p", parent]
+                    sha = repo.git(args, env=dict(os.environ, **_GIT_IDENTITY))
+                    raise _Response(201, {"sha": sha, "url": "{}/{}".format(url, sha), "message": payload["message"],
+                                          "tree": {"sha": payload["tree"]}, "parents": [{"sha": p} for p in payload.get("parents", [])]})
+                if rest[1] == "refs":
+                    ref = payload["ref"]
+                    repo.git(["cat-file", "-e", payload["sha"] + "^{commit}"])
+                    # The empty old value makes update-ref fail if the ref exists.
+                    try:
+                        repo.git(["update-ref", ref, payload["sha"], ""])
+                    except _Response:
+                        raise _Response(422, {"message": "Reference already exists"})
+                    raise _Response(201, {"ref": ref, "url": "{}/{}".format(url, ref[len("refs/"):]),
+                                          "object": {"sha": payload["sha"], "type": "commit"}})
+
+        if parts[:2] == ["search", "code"]:
+            # Every repository matches the query, with two hits so ghtt has to deduplicate them.
+            items = []
+            for org in gh.orgs.values():
+                for repo in sorted(org.values(), key=lambda r: r.name):
+                    for file_name in ("README.md", "main.c"):
+                        items.append({"name": file_name, "path": file_name, "sha": "0" * 40,
+                                      "url": "{}/repos/{}/{}/contents/{}".format(base, repo.org, repo.name, file_name),
+                                      "repository": repo.json(gh)})
+            page, link = handler.page(items[:1000], query)
+            return {"total_count": len(items), "incomplete_results": False, "items": page}, link
+        if parts[:2] == ["search", "issues"]:
+            # Only the queries of ghtt are supported: open pull requests of an org from a branch.
+            qualifiers = dict(term.split(":", 1) for term in query.get("q", "").split() if ":" in term)
+            items = []
+            for org, repos in sorted(gh.orgs.items()):
+                if "org" in qualifiers and qualifiers["org"] != org:
+                    continue
+                for repo in sorted(repos.values(), key=lambda r: r.name):
+                    for pull in repo.pulls:
+                        if pull["state"] == "open" and qualifiers.get("head", pull["head"]["ref"]) == pull["head"]["ref"]:
+                            items.append({"number": pull["number"], "id": pull["id"], "title": pull["title"], "state": "open",
+                                          "url": "{}/repos/{}/{}/issues/{}".format(base, repo.org, repo.name, pull["number"]),
+                                          "repository_url": "{}/repos/{}/{}".format(base, repo.org, repo.name),
+                                          "pull_request": {"url": pull["url"], "html_url": pull["html_url"]}})
+            page, link = handler.page(items[:1000], query)
+            return {"total_count": len(items), "incomplete_results": False, "items": page}, link
+
+        raise _Response(404, {"message": "Not Found ({} {})".format(method, path)})
+
+    return Handler
+
+
+_ID_SEGMENT = re.compile(r"^\d+$")
+
+
+def _template(path: str) -> str:
+    """Turns a request path into an endpoint name for the request counts, e.g.
+    `/api/v3/repos/bench/bench-s1/collaborators/s1` into `/repos/{owner}/{repo}/collaborators/{id}`.
+    """
+    parts = path.split("/")[3:] if path.startswith("/api/v3/") else path.split("/")[1:]
+    if parts[:1] == ["repos"] and len(parts) >= 3:
+        parts[1:3] = ["{owner}", "{repo}"]
+        if len(parts) >= 5 and parts[3] in ("collaborators", "invitations", "milestones", "issues", "pulls"):
+            parts[4] = "{id}"
+        if len(parts) >= 5 and parts[3] == "branches":
+            parts[4:-1] = ["{branch}"]
+    elif parts[:1] == ["orgs"] and len(parts) >= 2:
+        parts[1] = "{org}"
+    return "/" + "/".join("{id}" if _ID_SEGMENT.match(p) else p for p in parts)
+
+
+_REPOSITORY_FIELD = re.compile(r'(r\d+): repository\(owner: ("(?:[^"\\]|\\.)*"), name: ("(?:[^"\\]|\\.)*")\)')
+
+
+def _graphql(gh: FakeGitHub, query: str) -> dict:
+    data, errors = {}, []
+    for alias, owner, name in _REPOSITORY_FIELD.findall(query):
+        repo = gh.orgs.get(json.loads(owner), {}).get(json.loads(name).lower())
+        if repo is None:
+            data[alias] = None
+            errors.append({"type": "NOT_FOUND", "path": [alias], "message": "Could not resolve to a Repository"})
+            continue
+        head = repo.head()
+        data[alias] = {
+            "nameWithOwner": "{}/{}".format(repo.org, repo.name),
+            "defaultBranchRef": {"target": head} if head else None,
+        }
+    result = {"data": data}
+    if errors:
+        result["errors"] = errors
+    return result
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""Runs ghtt commands against a local fake GitHub with generated rosters, and records the wall time,
+number of API requests and peak memory of each command as JSON.
+
+    python benchmarks/run.py --students 10,100,1000 --latency 0.05 --output results.json
+
+Each roster size gets a fresh fake GitHub and project directory. The commands run in that order,
+because each one needs the repositories created by `create-repos`.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_github import FakeGitHub  # noqa: E402 pylint: disable=wrong-import-position
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ORG = "bench"
+
+# Arguments of each benchmarked command, in the order they run. `{auth}` is replaced by the
+# authentication options of the command group.
+COMMANDS = {
+    "create-repos": ["assignment", "{auth}", "create-repos", "--yes"],
+    "grant": ["assignment", "{auth}", "grant", "--yes"],
+    "create-issues": ["assignment", "{auth}", "create-issues", "issues.yaml", "--yes"],
+    "pull": ["assignment", "{auth}", "pull", "--yes"],
+    "search": ["search", "{auth}", "--query", "main in:path"],
+    "create-pr": ["assignment", "{auth}", "create-pr", "--branch", "update", "--title", "Update",
+                  "--body", "New start code", "--yes"],
+    # Every repository has an open pull request from `update` now, so all of them are skipped.
+    "create-pr-rerun": ["assignment", "{auth}", "create-pr", "--branch", "update", "--title", "Update",
+                        "--body", "New start code", "--yes"],
+    "create-pr-api": ["assignment", "{auth}", "create-pr", "--branch", "update-api", "--title", "Update",
+                      "--body", "New files", "--api-files", "update", "--yes"],
+}
+
+GIT_IDENTITY = {
+    "GIT_AUTHOR_NAME": "ghtt benchmark", "GIT_AUTHOR_EMAIL": "benchmark@example.com",
+    "GIT_COMMITTER_NAME": "ghtt benchmark", "GIT_COMMITTER_EMAIL": "benchmark@example.com",
+}
+
+TEMPLATE_FILES = {
+    "README.md.jinja": "# {{ repo.name }}\n\nClone this repository with `git clone {{ clone_url }}`.\n",
+    "main.c": "#include <stdio.h>\n\nint main(void) {\n    return 0;\n}\n",
+    "students.txt.jinja": "{% for student in students %}{{ student.username }}\n{% endfor %}",
+}
+
+# Files that `create-pr --api-files` adds to each repository.
+UPDATE_FILES = {
+    "NOTES.md.jinja": "# Notes for {{ repo.name }}\n",
+    "tests/test_main.c": "int main(void) {\n    return 0;\n}\n",
+    "logo.bin": bytes(range(256)).decode("latin-1"),
+}
+
+ISSUES = """\
+- type: milestone
+  title: Deadline
+  due date: 2030-01-01
+  description: Deadline of the assignment
+- type: issue
+  title: Assignment
+  milestone: Deadline
+  body: |
+    Good luck, {{ repo.name }}!
+- type: issue
+  title: Questions
+  body: Ask your questions here.
+"""
+
+
+def write_project(directory: str, url: str, students: int, jobs: int):
+    """Creates a ghtt project with a roster of `students` students and a template repository."""
+    with open(os.path.join(directory, "ghtt.yaml"), "w") as f:
+        json.dump({
+            "url": "{}/{}".format(url, ORG),
+            "allow-insecure-http": True,  # the fake GitHub doesn't use TLS
+            "source": "./template",
+            "default-branch": "main",
+            "jobs": jobs,
+            "rate-limit": {"create-interval": 0},
+            "repos": {"has-issues": True},
+            "students": {
+                "source": "students.csv",
+                "field-mapping": {"username": "username", "comment": "{{ record['name'] }}"},
+            },
+        }, f, indent=2)  # JSON is valid YAML
+    with open(os.path.join(directory, "students.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["username", "name"])
+        for i in range(students):
+            writer.writerow(["student{:05d}".format(i), "Student {}".format(i)])
+    with open(os.path.join(directory, "issues.yaml"), "w") as f:
+        f.write(ISSUES)
+
+    for name, content in UPDATE_FILES.items():
+        path = os.path.join(directory, "update", name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content.encode("latin-1"))
+
+    template = os.path.join(directory, "template")
+    os.mkdir(template)
+    for name, content in TEMPLATE_FILES.items():
+        with open(os.path.join(template, name), "w") as f:
+            f.write(content)
+    env = dict(os.environ, **GIT_IDENTITY)
+    for command in (["git", "init", "--quiet"], ["git", "symbolic-ref", "HEAD", "refs/heads/main"],
+                    ["git", "add", "-A"], ["git", "commit", "--quiet", "-m", "start code"]):
+        subprocess.check_call(command, cwd=template, env=env)
+
+
+def run_command(name: str, directory: str, jobs: int, gh: FakeGitHub, log) -> dict:
+    args = []
+    for arg in COMMANDS[name]:
+        args.extend(["--token", "benchmark"] if arg == "{auth}" else [arg])
+    args.extend(["--jobs", str(jobs)])
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, XDG_CACHE_HOME=os.path.join(directory, ".cache"), **GIT_IDENTITY)
+
+    gh.reset_counts()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "ghtt"] + args, cwd=directory, env=env,
+                               stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT)
+    # create-pr always asks to confirm its settings, also with --yes.
+    process.stdin.write(b"y\n")
+    process.stdin.close()
+    # wait4 returns the resource usage of this child only.
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall_time = time.perf_counter() - start
+    requests = gh.reset_counts()
+
+    return {
+        "command": name,
+        "exit_code": process.returncode,
+        "wall_time_s": round(wall_time, 3),
+        "requests": sum(requests.values()),
+        "requests_by_endpoint": dict(sorted(requests.items(), key=lambda item: -item[1])),
+        # Kilobytes on Linux, bytes on macOS.
+        "peak_rss": usage.ru_maxrss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", default="10,100", help="comma-separated roster sizes (default: 10,100)")
+    parser.add_argument("--commands", default=",".join(COMMANDS), help="comma-separated commands to record (default: all)")
+    parser.add_argument("--jobs", type=int, default=8, help="value of --jobs for each command (default: 8)")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every request (default: 0.02)")
+    parser.add_argument("--rate-limit", type=int, default=5000, help="requests per rate limit window (default: 5000)")
+    parser.add_argument("--rate-window", type=float, default=3600, help="length of the rate limit window in seconds (default: 3600)")
+    parser.add_argument("--output", "-o", help="file to write the JSON results to (default: stdout)")
+    parser.add_argument("--keep", action="store_true", help="keep the project directories and ghtt output for inspection")
+    args = parser.parse_args()
+
+    recorded = [c.strip() for c in args.commands.split(",")]
+    unknown = set(recorded) - set(COMMANDS)
+    if unknown:
+        parser.error("unknown commands: {}".format(", ".join(sorted(unknown))))
+
+    commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    report = {
+        "ghtt_commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"jobs": args.jobs, "latency_s": args.latency, "rate_limit": args.rate_limit,
+                     "rate_window_s": args.rate_window},
+        "results": [],
+    }
+
+    for students in [int(n) for n in args.students.split(",")]:
+        directory = tempfile.mkdtemp(prefix="ghtt-benchmark-{}-".format(students))
+        gh = FakeGitHub(os.path.join(directory, "github"), latency=args.latency,
+                        rate_limit=args.rate_limit, rate_window=args.rate_window)
+        gh.add_org(ORG)
+        gh.start()
+        try:
+            project = os.path.join(directory, "project")
+            os.mkdir(project)
+            write_project(project, gh.url, students, args.jobs)
+            with open(os.path.join(directory, "ghtt.log"), "w") as log:
+                for name in COMMANDS:
+                    # Later commands need the repositories, so create-repos always runs.
+                    if name not in recorded and name != "create-repos":
+                        continue
+                    result = run_command(name, project, args.jobs, gh, log)
+                    print("{:>6} students  {:<16} {:>8.2f}s {:>7} requests  exit {}".format(
+                        students, name, result["wall_time_s"], result["requests"], result["exit_code"]), file=sys.stderr)
+                    if name in recorded:
+                        report["results"].append(dict(result, students=students))
+        finally:
+            gh.stop()
+            if args.keep:
+                print("Kept {}".format(directory), file=sys.stderr)
+            else:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
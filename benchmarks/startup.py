@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Measures how long ghtt takes to start, and checks it against a budget.
+
+    python benchmarks/startup.py --budget 0.3
+
+Each command runs several times and the median wall time is compared with the budget. The modules
+imported by each command are recorded with `python -X importtime`; commands that don't need them
+must not import PyGithub, requests, jinja2 or the other heavy dependencies. Exits with status 1
+when a command is over the budget or imports a heavy module.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Top-level packages that take tens of milliseconds or more to import.
+HEAVY_MODULES = ["github", "requests", "jinja2", "yaml", "natsort", "tabulate", "dateutil"]
+
+# Commands that must start without the heavy modules.
+COMMANDS = {
+    "help": ["--help"],
+    "util help": ["util", "--help"],
+    "grep-in help": ["util", "grep-in", "--help"],
+    "branches-to-folders help": ["util", "branches-to-folders", "--help"],
+}
+
+
+def imported_modules(args: list, env: dict) -> list:
+    """Returns the top-level modules imported by `python -m ghtt <args>`."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-m", "ghtt"] + args, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and line.count("|") == 2:
+            name = line.rsplit("|", 1)[1].strip()
+            modules.add(name.split(".")[0])
+    return sorted(modules)
+
+
+def wall_time(command: list, env: dict) -> float:
+    start = time.perf_counter()
+    subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=0.3, help="maximum median startup time in seconds (default: 0.3)")
+    parser.add_argument("--runs", type=int, default=7, help="runs per command (default: 7)")
+    parser.add_argument("--output", "-o", help="file to write the JSON results to (default: stdout)")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    # Python itself, as a baseline for the budget.
+    baseline = statistics.median(wall_time([sys.executable, "-c", "pass"], env) for _ in range(args.runs))
+
+    results = []
+    failed = False
+    for name, ghtt_args in COMMANDS.items():
+        command = [sys.executable, "-m", "ghtt"] + ghtt_args
+        wall_time(command, env)  # warm up the bytecode cache
+        median = statistics.median(wall_time(command, env) for _ in range(args.runs))
+        heavy = sorted(set(imported_modules(ghtt_args, env)) & set(HEAVY_MODULES))
+        ok = median <= args.budget and not heavy
+        failed = failed or not ok
+        results.append({"command": name, "median_s": round(median, 3), "heavy_imports": heavy, "ok": ok})
+        print("{:<26} {:>6.3f}s  {}{}".format(
+            name, median, "ok" if ok else "FAIL",
+            "  imports {}".format(", ".join(heavy)) if heavy else ""), file=sys.stderr)
+
+    output = json.dumps({"budget_s": args.budget, "python_startup_s": round(baseline, 3), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,56 @@
 #!/usr/bin/env python3
+import importlib
+
 import click
 
-from .search import search
-from .assignment import assignment
-from .util import util
 
+class LazyGroup(click.Group):
+    """Group that imports the module of a subcommand only when that subcommand runs, so `--help` and
+    commands that don't talk to GitHub don't pay for importing PyGithub, requests and jinja2.
+    """
+    # name -> (module, attribute, help shown in the command list)
+    lazy_commands = {
+        'assignment': ('ghtt.assignment', 'assignment', ''),
+        'search': ('ghtt.search', 'search',
+                   'Searches repositories matching the query, prints the matching repositories, name and email '
+                   'address of the last committer, and optionally emails this info using Mailgun.'),
+        'util': ('ghtt.util', 'util', ''),
+    }
 
-@click.group()
-@click.pass_context
-def cli(ctx):
-    ctx.obj = {}
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        command = super().get_command(ctx, cmd_name)
+        if command is None and cmd_name in self.lazy_commands:
+            module, attribute, _ = self.lazy_commands[cmd_name]
+            command = getattr(importlib.import_module(module), attribute)
+            self.add_command(command, cmd_name)
+        return command
 
+    def format_commands(self, ctx, formatter):
+        # Commands that aren't imported yet are listed with their static help instead of importing them.
+        commands = [(name, self.commands.get(name) or click.Command(name, help=self.lazy_commands[name][2]))
+                    for name in self.list_commands(ctx)]
+        commands = [(name, command) for name, command in commands if not command.hidden]
+        if commands:
+            limit = formatter.width - 6 - max(len(name) for name, _ in commands)
+            with formatter.section('Commands'):
+                formatter.write_dl([(name, command.get_short_help_str(limit)) for name, command in commands])
 
-cli.add_command(search)
-cli.add_command(assignment)
-cli.add_command(util)
+
+@click.group(cls=LazyGroup)
+@click.option(
+    '--trace',
+    help='Write every GitHub API request, git command and repository job to this file (JSON lines), and print a summary of where the time went at the end.',
+    type=click.Path(dir_okay=False, writable=True))
+@click.pass_context
+def cli(ctx, trace=None):
+    ctx.obj = {}
+    if trace:
+        import ghtt.trace
+        ghtt.trace.start(trace)
+        ctx.call_on_close(ghtt.trace.stop)
 
 
 if __name__ == "__main__":
@@ -1,23 +1,31 @@
 #!/usr/bin/env python3
+import json
 import re
 from functools import wraps
 import os
 import subprocess
+import threading
 from datetime import datetime, date, timezone
-from typing import Optional, List, Dict, Union
+from typing import Optional, List, Dict, Tuple, Union
 
 import click
 import requests
-import yaml
 from github import Repository
 from github.GithubException import UnknownObjectException
-from tabulate import tabulate
-import jinja2
 import github
 from pathlib import Path
+from urllib.parse import quote
 
 from .auth import needs_auth
+from .pool import jobs_option, run_per_repo
+from .repoindex import OrgRepoIndex
 import ghtt.config
+import ghtt.generate
+import ghtt.gitdata
+import ghtt.graphql
+import ghtt.pool
+import ghtt.templating
+import ghtt.trace
 from ghtt.config import StudentRepo
 
 
@@ -61,8 +69,9 @@ class ProceedAsker:
 def _check_repo_groups(yes: bool, repos: Dict[str, StudentRepo]) -> Dict[str, StudentRepo]:
     # Check if all repo's have expected number of students/mentors
     ok_repos = {}
-    expected_group_size = ghtt.config.get('expected-group-size', 1)
-    expected_mentor_count = ghtt.config.get('expected-mentors-per-group', 0)
+    config = ghtt.config.load()
+    expected_group_size = config.expected_group_size
+    expected_mentor_count = config.expected_mentors_per_group
 
     asker = ProceedAsker(yes=False, action='proceed with invalid group')
 
@@ -115,11 +124,15 @@ def assignment(ctx):
 @click.option(
     '--source', '-s',
     help='Source directory',
-    default=lambda: ghtt.config.get('source', None))
+    default=lambda: ghtt.config.load().source)
 @click.option(
     '--branch-already-pushed', '-B',
     help="Branch has already been pushed, so this doesn't need to be done anymore.",
     is_flag=True)
+@click.option(
+    '--api-files',
+    help="Instead of pushing the source, create the branch through the GitHub API with the files in this directory added to the default branch. Files ending in .jinja are rendered for each repo. Needs no local clone or SSH keys.",
+    type=click.Path(exists=True, file_okay=False))
 @click.option(
     '--students',
     help='Comma-separated list of usernames. Defaults to all students.')
@@ -129,14 +142,24 @@ def assignment(ctx):
 @click.option(
     '--yes',
     help='Process all students/groups, without confirmation.', is_flag=True)
-def create_pr(ctx, branch, title, body, source, yes, students=None, groups=None, branch_already_pushed=False):
+@click.option(
+    '--push-jobs',
+    help='Maximum number of concurrent pushes, at most --jobs. These share one SSH connection, and SSH servers usually allow 10 sessions per connection.',
+    type=click.IntRange(min=1),
+    default=8)
+@jobs_option
+def create_pr(ctx, branch, title, body, source, yes, push_jobs, jobs, students=None, groups=None, branch_already_pushed=False, api_files=None):
     """Pushes updated code to a new branch on students repositories and creates a pr to merge that
     branch into master.
+
+    Repositories that already have an open pull request from the branch are skipped.
     """
     click.secho("# Branch: '{}'".format(branch), fg="green")
     click.secho("# title: '{}'".format(title), fg="green")
     click.secho("# message: '{}'".format(body), fg="green")
-    if not branch_already_pushed:
+    if api_files:
+        click.secho("# files: '{}'".format(api_files), fg="green")
+    elif not branch_already_pushed:
         click.secho("# source directory: '{}'".format(source), fg="green")
     else:
         click.secho("# Branch has been pushed already.", fg="green")
@@ -154,6 +177,7 @@ def create_pr(ctx, branch, title, body, source, yes, students=None, groups=None,
 
     g: github.Github = ctx.obj['pyg']
     g_org = g.get_organization(ghtt.config.get_organization())
+    org_repos = OrgRepoIndex(g_org)
 
     students = ghtt.config.get_students(usernames=students, groups=groups)
     mentors = ghtt.config.get_mentors()
@@ -162,59 +186,81 @@ def create_pr(ctx, branch, title, body, source, yes, students=None, groups=None,
 
     asker = ProceedAsker(yes=yes, action='create the PR for')
 
-    default_branch = ghtt.config.get('default-branch', 'master')
+    default_branch = ghtt.config.load().default_branch
+    with_open_pr = _repos_with_open_pr(g, g_org.login, branch)
 
+    selected = []
     for repo in repos.values():
-        try:
-            g_repo = g_org.get_repo(repo.name)
-        except UnknownObjectException:
+        g_repo = org_repos.get(repo.name)
+        if g_repo is None:
             click.secho("Warning: repository {} not found, skipping".format(repo.url), fg="yellow")
             continue
+        if repo.name.lower() in with_open_pr:
+            click.secho("Warning: repository {} already has an open pull request from {}, skipping".format(repo.url, branch), fg="yellow")
+            continue
         if not asker.should_proceed(repo.url):
             continue
-
-        if not branch_already_pushed:
-            command = ["git", "push", g_repo.ssh_url, f"{default_branch}:{branch}"]
-            cwd = source
-            click.secho("\nwill run `{}`\nin directory `{}`.".format(command, cwd))
-
-            subprocess.check_call(command, cwd=cwd)
-            pr = g_repo.create_pull(title=title, body=body, base=default_branch, head=branch)
-            click.secho("created pull request {}".format(pr.html_url))
-        else:
-            click.secho("Creating pull request in {}".format(repo.name), fg="green")
+        selected.append((repo, g_repo))
+
+    # Pushes run in the pool's threads, so there can't be more than --jobs at once anyway.
+    push_slots = threading.Semaphore(min(push_jobs, jobs))
+
+    if api_files:
+        # The files are read once, and the head of every repo is fetched with a single query.
+        files = ghtt.gitdata.read_files(api_files)
+        blobs = ghtt.gitdata.Blobs()
+        commits = ghtt.graphql.last_commits(g, [g_repo.full_name for _, g_repo in selected])
+
+    with ghtt.generate.ssh_multiplexing(source) as push_env:
+        def create_repo_pr(item):
+            repo, g_repo = item
+            if api_files:
+                head = commits.get(g_repo.full_name)
+                if head is None:
+                    raise AbortGhtt("{} has no commits to add the files to".format(g_repo.full_name))
+                ghtt.pool.secho("Creating branch {} in {} with the GitHub API".format(branch, g_repo.name), fg="green")
+                ghtt.gitdata.create_branch(
+                    g_repo, files, blobs,
+                    render=lambda template: render_template(template, g_repo.clone_url, repo),
+                    parent_sha=head.sha, parent_tree_sha=head.tree_sha,
+                    branch=branch, message=title)
+            elif not branch_already_pushed:
+                command = ["git", "push", g_repo.ssh_url, f"{default_branch}:{branch}"]
+                cwd = source
+                ghtt.pool.secho("\nwill run `{}`\nin directory `{}`.".format(command, cwd))
+
+                with push_slots:
+                    ghtt.pool.check_call(command, cwd=cwd, env=push_env)
+            else:
+                ghtt.pool.secho("Creating pull request in {}".format(g_repo.name), fg="green")
             pr = g_repo.create_pull(title=title, body=body, base=default_branch, head=branch)
-            click.secho("created pull request {}".format(pr.html_url))
+            ghtt.pool.secho("created pull request {}".format(pr.html_url))
 
+        failures = run_per_repo(selected, create_repo_pr, jobs=jobs, name=lambda item: item[0].name)
+    ghtt.pool.exit_on_failures(failures)
 
-def generate_file_from_template(path, clone_url, repo: ghtt.config.StudentRepo):
-    """generate_file_from_template fills in the provided jinja2 template. If the filename ends with
-    `.jinja`, the template file is removed and the result is saved without that extension. If not,
-    the template file is overwritten with the generated result.
+
+def _repos_with_open_pr(g: github.Github, organization: str, branch: str) -> set:
+    """Returns the lowercase names of the repositories in the organization that have an open pull
+    request from `branch`, using a single search instead of a request per repository.
     """
-    try:
-        template = open(path).read()
-        outputText = render_template(template, clone_url, repo)
-        destination = str(path)
-        if destination.endswith('.jinja'):
-            os.remove(path)
-            destination = destination[:-6]
-        with open(destination, "w+") as d_file:
-            d_file.write(outputText)
-    except:
-        click.secho(f'Problem generating template for path={path} clone_url={clone_url}', fg='red')
-        raise
-
-
-def render_template(template: str, clone_url, repo: ghtt.config.StudentRepo) -> str:
-    template = jinja2.Template(template)
-    return template.render(
-        clone_url=clone_url,
-        group=repo.group,
-        students=repo.students,
-        mentors=repo.mentors,
-        repo=repo,
-    )
+    query = "is:pr is:open org:{} head:{}".format(organization, branch)
+    # The repository URL is part of the search result; `issue.repository` would fetch each repo.
+    return {issue.repository_url.rsplit("/", 1)[-1].lower() for issue in g.search_issues(query)}
+
+
+def render_template(template, clone_url, repo: ghtt.config.StudentRepo) -> str:
+    """Renders a template source, or a template compiled by `ghtt.templating`, for a repo."""
+    if isinstance(template, str):
+        template = ghtt.templating.get_template(template)
+    with ghtt.trace.phase("render"):
+        return template.render(
+            clone_url=clone_url,
+            group=repo.group,
+            students=repo.students,
+            mentors=repo.mentors,
+            repo=repo,
+        )
 
 
 @assignment.command()
@@ -222,7 +268,7 @@ def render_template(template: str, clone_url, repo: ghtt.config.StudentRepo) ->
 @click.option(
     '--source',
     help='path to repo with start code',
-    default=lambda: ghtt.config.get('source', None))
+    default=lambda: ghtt.config.load().source)
 @click.option(
     '--students',
     help='Comma-separated list of usernames. Defaults to all students.')
@@ -232,7 +278,8 @@ def render_template(template: str, clone_url, repo: ghtt.config.StudentRepo) ->
 @click.option(
     '--yes',
     help='Process all students/groups, without confirmation.', is_flag=True)
-def create_repos(ctx, source, yes, students=None, groups=None):
+@jobs_option
+def create_repos(ctx, source, yes, jobs, students=None, groups=None):
     """Create student repositories in the organization specified by the url.
     Each repository will contain a copy of the specified source and will have force-pushing disabled
     so students can not rewrite history.
@@ -253,6 +300,7 @@ def create_repos(ctx, source, yes, students=None, groups=None):
 
     g : github.Github = ctx.obj['pyg']
     g_org = g.get_organization(ghtt.config.get_organization())
+    org_repos = OrgRepoIndex(g_org)
 
     students = ghtt.config.get_students(usernames=students, groups=groups)
     mentors = ghtt.config.get_mentors()
@@ -261,65 +309,83 @@ def create_repos(ctx, source, yes, students=None, groups=None):
 
     asker = ProceedAsker(yes=yes, action='create the repo')
 
+    selected = []
     for repo in repos.values():
-        try:
-            g_repo = g_org.get_repo(repo.name)
+        if repo.name in org_repos:
             click.secho("Warning: repository {}/{} already exists; skipping..".format(g_org.html_url, repo.name), fg="yellow")
             continue
-        except UnknownObjectException:
-            pass
         if not asker.should_proceed(repo.url):
             continue
+        selected.append(repo)
+
+    config = ghtt.config.load()
+    default_branch = config.default_branch
+
+    # Each repo gets its own commit on top of the source branch. These are built with git plumbing,
+    # so the checkout of the source repo is never modified and repos can be generated concurrently.
+    base = ghtt.generate.resolve_commit(source, default_branch)
+    if base is None:
+        click.secho(f"The branch `{default_branch}` does not exist in the source repository. Please specify the correct source branch in `ghtt.yaml` using the `default-branch` keyword.")
+        if not config.default_branch_is_set:
+            click.secho(f"\n\nYou typically want to add the \"main\" branch as default in `ghtt.yaml`, like this:")
+            click.secho(f"\ndefault-branch: main", fg="blue")
+        raise AbortGhtt()
+
+    # The templates are listed, read and compiled only once, instead of for every repo.
+    manifest = ghtt.generate.TemplateManifest(source, base)
+    click.secho("# Templates: {}".format([t.path for t in manifest.templates]), fg="green")
 
+    def create_student_repo(repo: StudentRepo):
         g_repo = g_org.create_repo(
             repo.name, private=True,
-            has_issues=ghtt.config.get('repos.has-issues', False),
-            has_wiki=ghtt.config.get('repos.has-wiki', False),
+            description=repo.comment,
+            has_issues=config.repos_has_issues,
+            has_wiki=config.repos_has_wiki,
             has_downloads=False,
             has_projects=False,
         )
+        org_repos.add(g_repo)
 
-        default_branch = ghtt.config.get('default-branch', 'master')
+        ghtt.pool.secho("\n\nGenerating repo {}/{}".format(g_org.html_url, repo.name), fg="green")
 
-        click.secho("\n\nGenerating repo {}/{}".format(g_org.html_url, repo.name), fg="green")
+        rendered = {}
+        for template in manifest.templates:
+            try:
+                rendered[template] = render_template(template.template, g_repo.clone_url, repo)
+            except:
+                ghtt.pool.secho(f'Problem generating template for path={template.path} clone_url={g_repo.clone_url}', fg='red')
+                raise
+        commit = ghtt.generate.generate_commit(manifest, rendered)
+        ghtt.pool.secho("Pushing source to {}".format(g_repo.ssh_url), fg="green")
+        ghtt.generate.push(source, commit, g_repo.ssh_url, default_branch)
 
-        try:
-            subprocess.check_call(["git", "checkout", default_branch], cwd=source)
-        except subprocess.CalledProcessError:
-            click.secho(f"The branch `{default_branch}` does not exist in the source repository. Please specify the correct source branch in `ghtt.yaml` using the `default-branch` keyword.")
-            if ghtt.config.get('default-branch', None) is None:
-                click.secho(f"\n\nYou typically want to add the \"main\" branch as default in `ghtt.yaml`, like this:")
-                click.secho(f"\ndefault-branch: main", fg="blue")
-            raise
-        subprocess.call(["git", "branch", "-D", repo.name], cwd=source)
-        subprocess.check_call(["git", "checkout", "-b", repo.name], cwd=source)
-
-        for path in Path(source).rglob('*.jinja'):
-            generate_file_from_template(
-                path,
-                clone_url=g_repo.clone_url,
-                repo=repo)
-        subprocess.check_call(["git", "add", "-A"], cwd=source)
-        subprocess.call(["git", "commit", "-m", "fill in templates"], cwd=source)
-        click.secho("Pushing source to {}".format(g_repo.ssh_url), fg="green")
-        subprocess.check_call(["git", "push", g_repo.ssh_url, f"{repo.name}:{default_branch}"], cwd=source)
-        subprocess.check_call(["git", "checkout", default_branch], cwd=source)  # go back to source branch
-
-        click.secho(f"Protecting the {default_branch} branch so students can't rewrite history", fg="green")
-        g_repo = g_org.get_repo(repo.name)
-        g_repo.edit(default_branch=default_branch)
-        g_master = g_repo.get_branch(default_branch)
-        # Note: allow_force_pushes=False is default for edit_protection()
-        require_pull_requests = ghtt.config.get('repos.require-pull-requests', False)
-        if require_pull_requests:
-            g_master.edit_protection(
-                required_approving_review_count=0,  # Corresponds to "Require a pull request before merging"
-            )
-        else:
-            g_master.edit_protection()
+        # The new repo already knows its default branch, so it only needs to be changed when it's different.
+        if g_repo.default_branch != default_branch:
+            g_repo.edit(default_branch=default_branch)
+
+        ghtt.pool.secho(f"Protecting the {default_branch} branch so students can't rewrite history", fg="green")
+        _protect_branch(g_repo, default_branch, require_pull_requests=config.repos_require_pull_requests)
+
+    ghtt.pool.exit_on_failures(run_per_repo(selected, create_student_repo, jobs=jobs))
 
-        click.secho("Adding comment to repo", fg="green")
-        g_repo.edit(description=repo.comment)
+
+def _protect_branch(g_repo: github.Repository.Repository, branch: str, require_pull_requests: bool):
+    """Disables force-pushing to a branch with a single request. This is what
+    `Branch.edit_protection()` does, without fetching the branch first.
+    """
+    # Note: force pushes are not allowed by default
+    reviews = {"required_approving_review_count": 0} if require_pull_requests else None  # "Require a pull request before merging"
+    g_repo.requester.requestJsonAndCheck(
+        "PUT",
+        "{}/branches/{}/protection".format(g_repo.url, quote(branch, safe="")),
+        headers={"Accept": github.Consts.mediaTypeRequireMultipleApprovingReviews},
+        input={
+            "required_status_checks": None,
+            "enforce_admins": None,
+            "required_pull_request_reviews": reviews,
+            "restrictions": None,
+        },
+    )
 
 
 @assignment.command()
@@ -333,7 +399,8 @@ def create_repos(ctx, source, yes, students=None, groups=None):
 @click.option(
     '--destroy-data',
     help='Confirm that you want to use this command that can destroy data.', is_flag=True)
-def delete_repos(ctx, students=None, groups=None, destroy_data=False):
+@jobs_option
+def delete_repos(ctx, jobs, students=None, groups=None, destroy_data=False):
     """Delete student repositories in the organization specified by the url.
 
     WARNING: this is obviously a dangerous operation! Consider using the command 'ghtt assignment rename repo' to rename repos instead of deleting them."""
@@ -347,7 +414,7 @@ def delete_repos(ctx, students=None, groups=None, destroy_data=False):
         click.secho("Add the command line option --destroy-data to enable the delete-repos command.")
         exit(1)
 
-    if not ghtt.config.get("enable-repo-delete", False):
+    if not ghtt.config.load().enable_repo_delete:
         click.secho("Add the line \"enable-repo-delete: True\" to your ghtt config to enable the delete-repos command.")
         exit(1)
 
@@ -362,6 +429,7 @@ def delete_repos(ctx, students=None, groups=None, destroy_data=False):
 
     g : github.Github = ctx.obj['pyg']
     g_org = g.get_organization(ghtt.config.get_organization())
+    org_repos = OrgRepoIndex(g_org)
 
     students = ghtt.config.get_students(usernames=students, groups=groups)
     mentors = ghtt.config.get_mentors()
@@ -370,19 +438,22 @@ def delete_repos(ctx, students=None, groups=None, destroy_data=False):
 
     asker = ProceedAsker(yes=yes, action='delete the repo')
 
+    g_repos = []
     for repo in repos.values():
-        try:
-            g_repo = g_org.get_repo(repo.name)
-        except UnknownObjectException:
+        g_repo = org_repos.get(repo.name)
+        if g_repo is None:
             click.secho("Warning: repository {}/{} does not exist; skipping..".format(g_org.html_url, repo.name), fg="yellow")
             continue
         if not asker.should_proceed(repo.url):
             continue
+        g_repos.append(g_repo)
 
-        click.secho("\n\nDeleting repo {}/{}".format(g_org.html_url, repo.name), fg="green")
-
+    def delete_repo(g_repo):
+        ghtt.pool.secho("\n\nDeleting repo {}/{}".format(g_org.html_url, g_repo.name), fg="green")
         g_repo.delete()
 
+    ghtt.pool.exit_on_failures(run_per_repo(g_repos, delete_repo, jobs=jobs))
+
 
 @assignment.command()
 @click.pass_context
@@ -398,9 +469,12 @@ def delete_repos(ctx, students=None, groups=None, destroy_data=False):
 @click.option(
     '--yes',
     help='Process all students/groups, without confirmation.', is_flag=True)
-def create_issues(ctx, path, yes, students=None, groups=None):
+@jobs_option
+def create_issues(ctx, path, yes, jobs, students=None, groups=None):
     """Create issues in the repositories of the specified users and groups.
     """
+    import yaml
+
     if students:
         students = [s.strip() for s in students.split(",")]
     if groups:
@@ -410,6 +484,7 @@ def create_issues(ctx, path, yes, students=None, groups=None):
 
     g: github.Github = ctx.obj['pyg']
     g_org = g.get_organization(ghtt.config.get_organization())
+    org_repos = OrgRepoIndex(g_org)
 
     students = ghtt.config.get_students(usernames=students, groups=groups)
     mentors = ghtt.config.get_mentors()
@@ -421,23 +496,45 @@ def create_issues(ctx, path, yes, students=None, groups=None):
     with open(path) as f:
         issue_template_content = f.read()
 
+    # Templates that don't use per-repo variables only need to be rendered and parsed once.
+    shared_issue_dicts = None
+    if ghtt.templating.is_repo_invariant(issue_template_content):
+        shared_issue_dicts = yaml.safe_load(ghtt.templating.get_template(issue_template_content).render())
+
+    selected = []
     for repo in repos.values():
-        try:
-            g_repo = g_org.get_repo(repo.name)
-        except UnknownObjectException:
+        g_repo = org_repos.get(repo.name)
+        if g_repo is None:
             click.secho("Warning: repository {} not found, skipping".format(repo.url), fg="yellow")
             continue
         if not asker.should_proceed(repo.url):
             continue
+        selected.append((repo, g_repo))
 
-        click.secho("Generating issues in repo {}/{}".format(g_org.html_url, repo.name), fg="green")
+    def create_repo_issues(item):
+        repo, g_repo = item
+        ghtt.pool.secho("Generating issues in repo {}/{}".format(g_org.html_url, repo.name), fg="green")
 
-        issue_dicts: Optional[List[Dict]] = yaml.safe_load(render_template(issue_template_content, g_repo.ssh_url, repo))
+        issue_dicts: Optional[List[Dict]] = shared_issue_dicts
+        if issue_dicts is None:
+            issue_dicts = yaml.safe_load(render_template(issue_template_content, g_repo.ssh_url, repo))
         assert issue_dicts is not None
         assert isinstance(issue_dicts, list)
         assert len(issue_dicts) > 0
         assert isinstance(issue_dicts[0], dict)
 
+        # Fetch the existing milestones and issues once and index them by title. The indexes are kept
+        # up to date when milestones and issues are created.
+        issue_types = {issue_dict.get('type') for issue_dict in issue_dicts}
+        milestones_by_title: Dict[str, List[github.Milestone.Milestone]] = {}
+        if issue_types & {'milestone', 'issue'}:
+            for g_milestone in g_repo.get_milestones():
+                milestones_by_title.setdefault(g_milestone.title, []).append(g_milestone)
+        issues_by_title: Dict[str, List[github.Issue.Issue]] = {}
+        if 'issue' in issue_types:
+            for g_issue in g_repo.get_issues():
+                issues_by_title.setdefault(g_issue.title, []).append(g_issue)
+
         for issue_dict in issue_dicts:
             issue_type = issue_dict.get('type')
 
@@ -457,48 +554,47 @@ def create_issues(ctx, path, yes, students=None, groups=None):
                     assert due_on.tzinfo is not None and due_on.tzinfo.utcoffset(due_on) is not None
 
                 # find existing milestone with same title
-                matching_milestone = [existing_milestone for existing_milestone in g_repo.get_milestones()
-                                      if existing_milestone.title == issue_dict.get('title')]
+                matching_milestone = milestones_by_title.get(issue_dict.get('title'), [])
                 if len(matching_milestone) == 1:
                     if issue_dict.get('title') == matching_milestone[0].title and \
                        issue_dict.get('description') == matching_milestone[0].description and \
                         due_on == matching_milestone[0].due_on.replace(tzinfo=timezone.utc):
-                        click.secho("Skipping up to date milestone '{}'".format(issue_dict.get('title')), fg="green")
+                        ghtt.pool.secho("Skipping up to date milestone '{}'".format(issue_dict.get('title')), fg="green")
                     else:
-                        click.secho("Updating milestone '{}'".format(issue_dict.get('title')), fg="green")
+                        ghtt.pool.secho("Updating milestone '{}'".format(issue_dict.get('title')), fg="green")
                         matching_milestone[0].edit(
                             title=issue_dict.get('title'),
                             description=issue_dict.get('description'),
                             due_on=due_on,
                         )
                 elif len(matching_milestone) == 0:
-                    click.secho("Adding milestone '{}'".format(issue_dict.get('title')), fg="green")
+                    ghtt.pool.secho("Adding milestone '{}'".format(issue_dict.get('title')), fg="green")
                     try:
-                        g_repo.create_milestone(
+                        g_milestone = g_repo.create_milestone(
                             title=issue_dict.get('title'),
                             description=issue_dict.get('description'),
                             due_on=due_on,
                         )
+                        milestones_by_title[g_milestone.title] = [g_milestone]
                     except github.GithubException as e:
                         if len(e.data["errors"]) != 1 or e.data["errors"][0]["code"] != "already_exists":
                             raise
                 else:
                     # this is normally impossible
-                    click.secho(f"Skipping: There already exist {len(matching_milestone)} milestones "
-                                f"with title '{issue_dict.get('title')}'", fg="red")
+                    ghtt.pool.secho(f"Skipping: There already exist {len(matching_milestone)} milestones "
+                                    f"with title '{issue_dict.get('title')}'", fg="red")
             elif issue_type == 'issue':
                 # find the milestone, if any
                 milestone = issue_dict.get('milestone', github.GithubObject.NotSet)
                 if milestone is not github.GithubObject.NotSet:
-                    milestone = [ms for ms in g_repo.get_milestones() if ms.title == milestone][0]
+                    milestone = milestones_by_title[milestone][0]
 
                 # find existing issue with same title
-                matching_issue = [existing_issue for existing_issue in g_repo.get_issues()
-                                  if existing_issue.title == issue_dict.get('title')]
+                matching_issue = issues_by_title.get(issue_dict.get('title'), [])
 
                 if len(matching_issue) == 1:
-                    same_labels = issue_dict.get('labels', []).sort() == [l.name for l in matching_issue[0].labels].sort()
-                    same_assignees = set(issue_dict.get('assignees')) == set([l.login for l in matching_issue[0].assignees])
+                    same_labels = sorted(issue_dict.get('labels', [])) == sorted([l.name for l in matching_issue[0].labels])
+                    same_assignees = set(issue_dict.get('assignees', [])) == set([l.login for l in matching_issue[0].assignees])
                     same_milestone = (
                         issue_dict.get('milestone') == matching_issue[0].milestone or
                         matching_issue[0].milestone is not None and issue_dict.get('milestone') == matching_issue[0].milestone.title
@@ -508,9 +604,9 @@ def create_issues(ctx, path, yes, students=None, groups=None):
                        same_labels and \
                        same_assignees and \
                        same_milestone:
-                        click.secho("Skipping up to date issue '{}'".format(issue_dict.get('title')), fg="green")
+                        ghtt.pool.secho("Skipping up to date issue '{}'".format(issue_dict.get('title')), fg="green")
                     else:
-                        click.secho("Updating issue with title '{}'".format(issue_dict.get('title')), fg="green")
+                        ghtt.pool.secho("Updating issue with title '{}'".format(issue_dict.get('title')), fg="green")
                         matching_issue[0].edit(
                             title=issue_dict.get('title'),
                             body=issue_dict.get('body'),
@@ -520,20 +616,50 @@ def create_issues(ctx, path, yes, students=None, groups=None):
                             # state=xxx,
                         )
                 elif len(matching_issue) == 0:
-                    click.secho("Adding issue with title '{}'".format(issue_dict.get('title')), fg="green")
+                    ghtt.pool.secho("Adding issue with title '{}'".format(issue_dict.get('title')), fg="green")
                     try:
-                        g_repo.create_issue(
+                        g_issue = g_repo.create_issue(
                             title=issue_dict.get('title'),
                             body=issue_dict.get('body'),
                             milestone=milestone,
                             labels=issue_dict.get('labels', []),
                             assignees=issue_dict.get('assignees', []),
                         )
+                        issues_by_title[g_issue.title] = [g_issue]
                     except github.GithubException as e:
-                        click.secho("Warning: could not create issue. Do the assignees have access to the repo? Skipping\n{}".format(e), fg="yellow")
+                        ghtt.pool.secho("Warning: could not create issue. Do the assignees have access to the repo? Skipping\n{}".format(e), fg="yellow")
                 else:
-                    click.secho(f"Skipping: There already exist {len(matching_issue)} issues "
-                                f"with title '{issue_dict.get('title')}'", fg="red")
+                    ghtt.pool.secho(f"Skipping: There already exist {len(matching_issue)} issues "
+                                    f"with title '{issue_dict.get('title')}'", fg="red")
+
+    ghtt.pool.exit_on_failures(run_per_repo(selected, create_repo_issues, jobs=jobs, name=lambda item: item[0].name))
+
+
+class BranchHead:
+    def __init__(self, branch: str, sha: str, commit_time: datetime, author: str, subject: str):
+        self.branch = branch
+        self.sha = sha
+        self.commit_time = commit_time
+        self.author = author
+        self.subject = subject
+
+
+def _branch_heads(source: str) -> Dict[str, BranchHead]:
+    """Returns the last commit of each local branch of the source repository, using a single
+    `git for-each-ref` call.
+    """
+    output = subprocess.check_output(
+        ["git", "for-each-ref",
+         "--format=%(refname:short)%00%(objectname)%00%(committerdate:raw)%00%(authorname) %(authoremail)%00%(subject)",
+         "refs/heads/"],
+        cwd=source, universal_newlines=True)
+    heads = {}
+    for line in output.splitlines():
+        branch, sha, committer_date, author, subject = line.split("\0", 4)
+        # raw dates look like "1700000000 +0100"
+        commit_time = datetime.fromtimestamp(int(committer_date.split()[0]))
+        heads[branch] = BranchHead(branch, sha, commit_time, author, subject)
+    return heads
 
 
 @assignment.command()
@@ -541,7 +667,7 @@ def create_issues(ctx, path, yes, students=None, groups=None):
 @click.option(
     '--source',
     help='path to repo with start code',
-    default=lambda: ghtt.config.get('source', None))
+    default=lambda: ghtt.config.load().source)
 @click.option(
     '--students',
     help='Comma-separated list of usernames. Defaults to all students.')
@@ -551,8 +677,20 @@ def create_issues(ctx, path, yes, students=None, groups=None):
 @click.option(
     '--yes',
     help='Process all students/groups, without confirmation.', is_flag=True)
-def pull(ctx, source, yes, students=None, groups=None):
+@click.option(
+    '--remote-only',
+    help="Only show the latest commit of each repository on GitHub, without fetching the repositories.",
+    is_flag=True)
+@click.option(
+    '--fetch-all',
+    help="Fetch all repositories, also the ones whose latest commit was already fetched.",
+    is_flag=True)
+@jobs_option
+def pull(ctx, source, yes, jobs, students=None, groups=None, remote_only=False, fetch_all=False):
     """Show the latest commit of each student
+
+    Only repositories with new commits are fetched. The `Changed` column shows which repositories
+    changed since the previous pull.
     """
     if students:
         students = [s.strip() for s in students.split(",")]
@@ -565,6 +703,7 @@ def pull(ctx, source, yes, students=None, groups=None):
 
     g : github.Github = ctx.obj['pyg']
     g_org = g.get_organization(ghtt.config.get_organization())
+    org_repos = OrgRepoIndex(g_org)
 
     students = ghtt.config.get_students(usernames=students, groups=groups)
     repos = ghtt.config.get_repos(students, mentors=ghtt.config.get_mentors())
@@ -573,39 +712,89 @@ def pull(ctx, source, yes, students=None, groups=None):
 
     asker = ProceedAsker(yes=yes, action='pull')
 
-    # Make sure master is checked out because we can't pull to checked out branch
-    default_branch = ghtt.config.get('default-branch', 'master')
-    subprocess.check_call(["git", "checkout", default_branch], cwd=source)
+    # The head of each repo at the previous pull, to show which repos changed since then.
+    state_path = os.path.join(source, ".git", "ghtt-pull-state.json")
+    try:
+        with open(state_path) as f:
+            previous_heads = json.load(f)
+    except (OSError, ValueError):
+        previous_heads = {}
+    current_heads = dict(previous_heads)
+    failures = {}
+
+    def changed(g_repo, sha) -> str:
+        return "" if previous_heads.get(g_repo.name) == sha else "yes"
+
+    def pull_repo(g_repo):
+        try:
+            ghtt.pool.check_call(
+                ["git", "fetch", g_repo.ssh_url, "HEAD:refs/heads/{}".format(g_repo.name)], cwd=source)
+        except subprocess.CalledProcessError:
+            summary.append((g_repo.name, g_repo.description, datetime.now(), None, "pull failed; see output above", ""))
+            raise
 
     try:
+        selected = []
         for repo in repos.values():
-            try:
-                g_repo = g_org.get_repo(repo.name)
-            except UnknownObjectException:
-                summary.append((repo.name, repo.comment, datetime.now(), None, "pull failed: repository not found"))
+            g_repo = org_repos.get(repo.name)
+            if g_repo is None:
+                summary.append((repo.name, repo.comment, datetime.now(), None, "pull failed: repository not found", ""))
                 continue
 
             if not asker.should_proceed(repo.url):
                 continue
+            selected.append(g_repo)
+
+        # One batched query tells us the remote head of every repo, so we only need to fetch the repos
+        # whose head is not in the source repo yet.
+        commits = ghtt.graphql.last_commits(g, [g_repo.full_name for g_repo in selected])
+
+        if remote_only:
+            for g_repo in selected:
+                commit = commits[g_repo.full_name]
+                if commit is None:
+                    summary.append((g_repo.name, g_repo.description, datetime.now(), None, "repository has no commits", ""))
+                    continue
+                commit_time = commit.committed_date.astimezone().replace(tzinfo=None)
+                committer = "{} <{}>".format(commit.author_name, commit.author_email)
+                summary.append((g_repo.name, g_repo.description, commit_time, committer, commit.message,
+                                changed(g_repo, commit.sha)))
+            return
+
+        # Make sure master is checked out because we can't pull to checked out branch
+        default_branch = ghtt.config.load().default_branch
+        subprocess.check_call(["git", "checkout", default_branch], cwd=source)
+
+        local_heads = _branch_heads(source)
+        to_fetch = []
+        for g_repo in selected:
+            commit = commits[g_repo.full_name]
+            local_head = local_heads.get(g_repo.name)
+            if fetch_all or commit is None or local_head is None or local_head.sha != commit.sha:
+                to_fetch.append(g_repo)
+        click.secho("# Fetching {} of {} repositories; the others did not change".format(
+            len(to_fetch), len(selected)), fg="green")
+
+        failures = run_per_repo(to_fetch, pull_repo, jobs=jobs)
+
+        # Read the last commit of all branches at once.
+        local_heads = _branch_heads(source)
+        for g_repo in selected:
+            ref = local_heads.get(g_repo.name)
+            if g_repo.name in failures or ref is None:
+                continue
+            summary.append((g_repo.name, g_repo.description, ref.commit_time, ref.author, ref.subject,
+                            changed(g_repo, ref.sha)))
+            current_heads[g_repo.name] = ref.sha
 
-            try:
-                g_repo = g_org.get_repo(repo.name)
-
-                subprocess.check_call(
-                    ["git", "fetch", g_repo.ssh_url, "HEAD:{}".format(g_repo.name)], cwd=source)
-
-                # subprocess.check_call(["git", "checkout", g_repo.name], cwd=source)
-                timestamp = subprocess.check_output(["git", "log", g_repo.name, "-1", "--pretty=format:%ct"], cwd=source, universal_newlines=True).rstrip()
-                commit_summary = subprocess.check_output(["git", "log", g_repo.name, "-1", "--pretty=format:%s"], cwd=source, universal_newlines=True)
-                committer = subprocess.check_output(["git", "log", g_repo.name, "-1", "--pretty=format:%an <%ae>"], cwd=source, universal_newlines=True)
-
-                commit_time = datetime.fromtimestamp(int(timestamp))
-                summary.append((g_repo.name, g_repo.description, commit_time, committer, commit_summary))
-            except subprocess.CalledProcessError:
-                summary.append((g_repo.name, g_repo.description, datetime.now(), None, "pull failed; see output above"))
+        with open(state_path, "w") as f:
+            json.dump(current_heads, f, indent=2, sort_keys=True)
     finally:
+        from tabulate import tabulate
+
         summary.sort(key=lambda tup: tup[2])
-        click.secho(tabulate(summary, headers=['Username', "Description", 'Last commit time', "Committer info", 'Commit summary']))
+        click.secho(tabulate(summary, headers=['Username', "Description", 'Last commit time', "Committer info", 'Commit summary', 'Changed']))
+    ghtt.pool.exit_on_failures(failures)
 
 
 @assignment.command()
@@ -627,11 +816,11 @@ def rename_repo(ctx, yes, match, replace):
 
     g: github.Github = ctx.obj['pyg']
     g_org = g.get_organization(ghtt.config.get_organization())
-    g_repos = g_org.get_repos('all')
+    org_repos = OrgRepoIndex(g_org)
 
     asker = ProceedAsker(yes=yes, action='rename repo')
 
-    for g_repo in g_repos:
+    for g_repo in org_repos:
         match = pattern.match(g_repo.name)
         if not match:
             continue
@@ -658,11 +847,13 @@ def rename_repo(ctx, yes, match, replace):
 @click.option(
     '--yes',
     help='Process all students/groups, without confirmation.', is_flag=True)
-def grant(ctx, yes, read_only, students=None, groups=None):
+@jobs_option
+def grant(ctx, yes, read_only, jobs, students=None, groups=None):
     """Grant each student pull/push access (the collaborator role) to their repository in the
     organization specified by the url.
     If students already have access, this will force set the new access.
     Thus --read-only will change existing push access to pull access.
+    Students who already have the right access or a pending invitation for it are left alone.
     """
     if students:
         students = [s.strip() for s in students.split(",")]
@@ -674,6 +865,7 @@ def grant(ctx, yes, read_only, students=None, groups=None):
 
     g : github.Github = ctx.obj['pyg']
     g_org = g.get_organization(ghtt.config.get_organization())
+    org_repos = OrgRepoIndex(g_org)
 
     students = ghtt.config.get_students(usernames=students, groups=groups)
     repos = ghtt.config.get_repos(students, mentors=ghtt.config.get_mentors())
@@ -682,23 +874,76 @@ def grant(ctx, yes, read_only, students=None, groups=None):
 
     asker = ProceedAsker(yes=yes, action='give students')
 
+    selected = []
     for repo in repos.values():
-        try:
-            g_repo = g_org.get_repo(repo.name)
-        except UnknownObjectException:
+        g_repo = org_repos.get(repo.name)
+        if g_repo is None:
             click.secho("Warning: repository {} not found, skipping".format(repo.url), fg="yellow")
             continue
         if not asker.should_proceed('{}" {} access to "{}'.format('", "'.join([s.username for s in repo.students]), permission, repo.url)):
             continue
+        selected.append((repo, g_repo))
+
+    # Invitations use different names for the same permissions.
+    invitation_permission = 'read' if read_only else 'write'
+    counts = {'already correct': 0, 'invited': 0, 'updated': 0, 'failed': 0}
+    counts_lock = threading.Lock()
+
+    def count(outcome: str):
+        with counts_lock:
+            counts[outcome] += 1
+
+    def grant_repo(item):
+        repo, g_repo = item
+        # Only change what is different, so students don't get duplicate invitations and we don't
+        # spend write requests on grants that are already correct.
+        collaborators = {c.login.lower(): c for c in g_repo.get_collaborators(affiliation='direct')}
+        invitations = {i.invitee.login.lower(): i for i in g_repo.get_pending_invitations() if i.invitee}
 
-        click.secho("Granting students {} {} access to {}".format([s.username for s in repo.students], permission, repo.url), fg="green")
         for student in repo.students:
+            username = student.username.lower()
             try:
-                g_repo.add_to_collaborators(student.username, permission)
+                if username in collaborators:
+                    if _collaborator_permission(collaborators[username]) == permission:
+                        count('already correct')
+                        continue
+                    ghtt.pool.secho("Changing access of {} to {} in {}".format(student.username, permission, repo.url), fg="green")
+                    g_repo.add_to_collaborators(student.username, permission)
+                    count('updated')
+                elif username in invitations:
+                    invitation = invitations[username]
+                    if invitation.permissions == invitation_permission:
+                        count('already correct')
+                        continue
+                    ghtt.pool.secho("Changing invitation of {} to {} access in {}".format(student.username, permission, repo.url), fg="green")
+                    # invitation.url is the invitee's endpoint to accept the invitation.
+                    g_repo.requester.requestJsonAndCheck(
+                        "PATCH", "{}/invitations/{}".format(g_repo.url, invitation.id),
+                        input={"permissions": invitation_permission})
+                    count('updated')
+                else:
+                    ghtt.pool.secho("Granting {} {} access to {}".format(student.username, permission, repo.url), fg="green")
+                    g_repo.add_to_collaborators(student.username, permission)
+                    count('invited')
             except UnknownObjectException as e:
-                click.secho("Warning: {} ({}) does not have a GitHub account, skipping\n{}".format(student.username, student.comment, e), fg="yellow")
+                count('failed')
+                ghtt.pool.secho("Warning: {} ({}) does not have a GitHub account, skipping\n{}".format(student.username, student.comment, e), fg="yellow")
             except github.GithubException as e:
-                click.secho("Warning: could not grant {} ({}), skipping\n{}".format(student.username, student.comment, e), fg="yellow")
+                count('failed')
+                ghtt.pool.secho("Warning: could not grant {} ({}), skipping\n{}".format(student.username, student.comment, e), fg="yellow")
+
+    failures = run_per_repo(selected, grant_repo, jobs=jobs, name=lambda item: item[0].name)
+    click.secho("# Grants: {}".format(", ".join("{} {}".format(n, outcome) for outcome, n in counts.items())), fg="green")
+    ghtt.pool.exit_on_failures(failures)
+
+
+def _collaborator_permission(collaborator: github.NamedUser.NamedUser) -> str:
+    """Returns the highest permission of a collaborator, using the names of `add_to_collaborators`."""
+    permissions = collaborator.permissions
+    for name in ('admin', 'maintain', 'push', 'triage', 'pull'):
+        if getattr(permissions, name, False):
+            return name
+    return 'none'
 
 
 @assignment.command()
@@ -712,10 +957,17 @@ def grant(ctx, yes, read_only, students=None, groups=None):
 @click.option(
     '--yes',
     help='Process all students/groups, without confirmation.', is_flag=True)
-def remove_grant(ctx, yes, students=None, groups=None):
+@click.option(
+    '--bulk',
+    help='Revoke all access at once: look up who has access in the organization first, then cancel all invitations and remove all collaborators concurrently.', is_flag=True)
+@jobs_option
+def remove_grant(ctx, yes, bulk, jobs, students=None, groups=None):
     """Removes students' access to their repository and cancels any open invitation for that
     student.
 
+    Use --bulk with a high --jobs to lock all repositories at a deadline. It skips the students
+    who don't have access, and doesn't wait for one repository to finish before starting the next.
+
     Hint: to remove only push access, but keep read-only access, use the grant command with --read-only to update the existing permissions.
     """
     if students:
@@ -728,34 +980,87 @@ def remove_grant(ctx, yes, students=None, groups=None):
 
     g : github.Github = ctx.obj['pyg']
     g_org = g.get_organization(ghtt.config.get_organization())
+    org_repos = OrgRepoIndex(g_org)
 
     students = ghtt.config.get_students(usernames=students, groups=groups)
     repos = ghtt.config.get_repos(students, mentors=ghtt.config.get_mentors())
 
     asker = ProceedAsker(yes=yes, action='remove grants from')
 
+    selected = []
     for repo in repos.values():
-        try:
-            g_repo = g_org.get_repo(repo.name)
-        except UnknownObjectException:
+        g_repo = org_repos.get(repo.name)
+        if g_repo is None:
             click.secho("Warning: repository {} not found, skipping".format(repo.url), fg="yellow")
             continue
         if not asker.should_proceed(repo.url):
             continue
+        selected.append((repo, g_repo))
+
+    if bulk:
+        _remove_grants_in_bulk(g_org, selected, jobs)
+        return
 
+    def remove_repo_grant(item):
+        repo, g_repo = item
         # Delete open invitations for that user
         # Do this before removing as collaborator so we don't get a race condition where
         # student accepts invitation between the remove as collaborator and the remove
         # of the invitation.
+        usernames = {s.username.lower() for s in repo.students}
         for invitation in g_repo.get_pending_invitations():
-            if str(invitation.invitee) in [s.username for s in repo.students]:
-                click.secho("Removing invitation for student '{}' for repo '{}'".format(
-                    invitation.invitee, repo.name), fg="green")
-                invitation.delete()
-                g_repo.remove_invitation(invitation.invite_id)
+            if invitation.invitee and invitation.invitee.login.lower() in usernames:
+                ghtt.pool.secho("Removing invitation for student '{}' for repo '{}'".format(
+                    invitation.invitee.login, repo.name), fg="green")
+                g_repo.remove_invitation(invitation.id)
 
         # Remove user from collaborators
         for username in [s.username for s in repo.students]:
-            click.secho("Removing '{}' as collaborators from '{}'".format(
+            ghtt.pool.secho("Removing '{}' as collaborators from '{}'".format(
                 username, repo.name), fg="green")
             g_repo.remove_from_collaborators(username)
+
+    ghtt.pool.exit_on_failures(run_per_repo(selected, remove_repo_grant, jobs=jobs, name=lambda item: item[0].name))
+
+
+def _remove_grants_in_bulk(g_org: github.Organization.Organization, selected: List[Tuple[StudentRepo, github.Repository.Repository]], jobs: int):
+    """Removes the students' access to the selected repositories, doing as much as possible
+    concurrently.
+
+    GitHub can't list the pending repository invitations of a whole organization, so those are
+    still listed per repository, but concurrently. Who has access is looked up once for the
+    organization: students who are neither outside collaborators nor members can't be
+    collaborators, so removing them is skipped.
+    """
+    # All invitations are cancelled before any collaborator is removed, so a student can't accept
+    # an invitation after losing access.
+    def cancel_invitations(item):
+        repo, g_repo = item
+        usernames = {s.username.lower() for s in repo.students}
+        for invitation in g_repo.get_pending_invitations():
+            if invitation.invitee and invitation.invitee.login.lower() in usernames:
+                ghtt.pool.secho("Removing invitation for student '{}' for repo '{}'".format(
+                    invitation.invitee.login, repo.name), fg="green")
+                g_repo.remove_invitation(invitation.id)
+
+    cancel_failures = run_per_repo(selected, cancel_invitations, jobs=jobs, name=lambda item: item[0].name)
+
+    # Only look up who has access after the invitations are gone: a student who accepted one
+    # during the sweep is an outside collaborator by now.
+    click.secho("# Looking up who has access to {}..".format(g_org.login), fg="green")
+    with_access = {u.login.lower() for u in g_org.get_outside_collaborators()}
+    with_access.update(u.login.lower() for u in g_org.get_members())
+
+    removals = [(repo, g_repo, student.username)
+                for repo, g_repo in selected
+                for student in repo.students
+                if student.username.lower() in with_access]
+    click.secho("# Removing {} collaborators from {} repositories..".format(len(removals), len(selected)), fg="green")
+
+    def remove_collaborator(item):
+        repo, g_repo, username = item
+        ghtt.pool.secho("Removing '{}' as collaborators from '{}'".format(username, repo.name), fg="green")
+        g_repo.remove_from_collaborators(username)
+
+    remove_failures = run_per_repo(removals, remove_collaborator, jobs=jobs, name=lambda item: "{}/{}".format(item[0].name, item[2]))
+    ghtt.pool.exit_on_failures(cancel_failures, remove_failures)
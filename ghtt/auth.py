@@ -1,15 +1,82 @@
 #!/usr/bin/env python3
 from functools import wraps
 import subprocess
+import threading
+import time
 from urllib.parse import urlparse
 
 import click
 import github as pygithub
 import requests
+from requests.adapters import BaseAdapter
+from urllib3.util.retry import Retry
 
 import ghtt.config
+from .cache import CachingAdapter, HttpCache
+from .ratelimit import RateLimitAdapter, RateLimiter
+import ghtt.trace
 
-def authenticate(url, token):
+
+class TraceAdapter(BaseAdapter):
+    """Transport adapter that records each request that goes to the network."""
+    def __init__(self, inner: BaseAdapter):
+        super().__init__()
+        self.inner = inner
+
+    def send(self, request, **kwargs):
+        started = time.perf_counter()
+        status = None
+        response = None
+        try:
+            response = self.inner.send(request, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            headers = response.headers if response is not None else {}
+            ghtt.trace.record("http", started, time.perf_counter() - started,
+                              method=request.method, endpoint=ghtt.trace.endpoint(request.url), status=status,
+                              rate_limit_remaining=headers.get("X-RateLimit-Remaining"),
+                              rate_limit_resource=headers.get("X-RateLimit-Resource"))
+
+    def close(self):
+        self.inner.close()
+
+
+def _connection_classes(wrappers):
+    """Returns PyGithub connection classes that send their requests through the transport adapters
+    created by `wrappers`. Each wrapper takes the adapter below it and returns the adapter to use.
+    """
+    def wrap(base):
+        class Connection(base):
+            def __init__(self, *args, **kwargs):
+                # PyGithub shares one connection between threads and stores the request to send on it,
+                # so keep that state per thread.
+                self._pending = threading.local()
+                super().__init__(*args, **kwargs)
+                for prefix in ("http://", "https://"):
+                    adapter = self.session.get_adapter(prefix)
+                    for wrapper in wrappers:
+                        adapter = wrapper(adapter)
+                    self.session.mount(prefix, adapter)
+
+        for attribute in ("verb", "url", "input", "headers", "stream"):
+            setattr(Connection, attribute, property(
+                lambda self, attribute=attribute: getattr(self._pending, attribute),
+                lambda self, value, attribute=attribute: setattr(self._pending, attribute, value)))
+        return Connection
+
+    return (wrap(pygithub.Requester.HTTPRequestsConnectionClass),
+            wrap(pygithub.Requester.HTTPSRequestsConnectionClass))
+
+
+def _install_adapters(wrappers):
+    requester = pygithub.Requester.Requester
+    requester.injectConnectionClasses(*_connection_classes(wrappers))
+    # Injecting connection classes disables persistent connections, but we want to keep reusing them.
+    requester._Requester__persist = True  # pylint: disable=protected-access
+
+
+def authenticate(url, token, http_cache: HttpCache = None, rate_limiter: RateLimiter = None):
     click.secho("# URL: '{}'".format(url), fg="green")
 
     if not token:
@@ -24,16 +91,42 @@ def authenticate(url, token):
         url = "https://" + url
 
     url = urlparse(url)
+    # The token would be sent in cleartext over http, so that is only used when explicitly allowed,
+    # e.g. for a local test server.
+    scheme = "http" if url.scheme == "http" and ghtt.config.load(required=False).allow_insecure_http else "https"
+
+    wrappers = []
+    if ghtt.trace.active():
+        wrappers.append(TraceAdapter)
+    if http_cache is not None:
+        wrappers.append(lambda adapter: CachingAdapter(adapter, http_cache))
+    if rate_limiter:
+        wrappers.append(lambda adapter: RateLimitAdapter(adapter, rate_limiter))
+    _install_adapters(wrappers)
+
+    client_options = dict(
+        per_page=100,
+        # Enough connections for the worker pool. Requests are paced by the rate limiter.
+        pool_size=32,
+        seconds_between_requests=None,
+        seconds_between_writes=None,
+        # PyGithub's default retry sleeps on rate limit responses itself, before the RateLimiter sees
+        # them. Only retry connection errors and server errors here.
+        retry=Retry(total=10, status_forcelist=(500, 502, 503, 504), backoff_factor=0.5,
+                    respect_retry_after_header=False, raise_on_status=False),
+    )
 
     if url.netloc == "github.com":
         pyg = pygithub.Github(
             login_or_token=token,
-            password=password)
+            password=password,
+            **client_options)
     else:
         pyg = pygithub.Github(
-            base_url="https://{url.netloc}/api/v3".format(url=url),
+            base_url="{}://{}/api/v3".format(scheme, url.netloc),
             login_or_token=token,
-            password=password)
+            password=password,
+            **client_options)
 
     return pyg
 
@@ -43,13 +136,30 @@ def needs_auth(f):
     @click.option(
         '--url', '-u',
         help='URL to Github instance. Defaults to github.com.',
-        default=lambda: ghtt.config.get('url', "https://github.com"))
+        default=lambda: ghtt.config.load().url)
     @click.option(
         '--token', '-t',
         help='Github authentication token.')
+    @click.option(
+        '--no-cache',
+        help='Do not use the on-disk cache of GitHub API responses.',
+        is_flag=True)
     @click.pass_context
-    def wrapper(ctx, *args, url=None, token=None, **kwargs):
-        ctx.obj['pyg'] = authenticate(url, token)
+    def wrapper(ctx, *args, url=None, token=None, no_cache=False, **kwargs):
+        config = ghtt.config.load(required=False)
+        rate_limiter = RateLimiter(create_interval=config.create_interval)
+        http_cache = None if no_cache else HttpCache(max_size=config.http_cache_size * 1024 * 1024)
+        ctx.obj['pyg'] = authenticate(url, token, http_cache=http_cache, rate_limiter=rate_limiter)
         ctx.obj['url'] = url
+        ctx.obj['rate_limiter'] = rate_limiter
+
+        def report():
+            summary = rate_limiter.report()
+            if http_cache is not None and http_cache.hits:
+                summary += ", {} answered from the cache".format(http_cache.hits)
+            click.secho(summary, fg="green")
+
+        # Runs when the command (and its subcommand, for groups) has finished.
+        ctx.call_on_close(report)
         return f(*args, **kwargs)
     return wrapper
\ No newline at end of file
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+def default_cache_dir() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "ghtt", "http")
+
+
+class HttpCache:
+    """On-disk store of GET responses and their validators (ETag and Last-Modified).
+
+    Each entry is a single file: a line of JSON metadata followed by the raw body. The total size
+    of the cache is bounded; when it grows too large, the least recently used entries are removed.
+    """
+    def __init__(self, path: str = None, max_size: int = 100 * 1024 * 1024):
+        self.path = path or default_cache_dir()
+        self.max_size = max_size
+        self.hits = 0  # requests answered from the cache after a 304 Not Modified
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def key(request: requests.PreparedRequest) -> str:
+        # Different tokens can see different data, and different media types return different bodies.
+        parts = [request.method, request.url, request.headers.get("Accept", ""),
+                 request.headers.get("Authorization", "")]
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def load(self, key: str) -> Optional[dict]:
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                meta = json.loads(f.readline().decode("utf-8"))
+                meta["body"] = f.read()
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return meta
+
+    def store(self, key: str, response: requests.Response):
+        meta = {
+            "url": response.url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "headers": dict(response.headers),
+        }
+        data = json.dumps(meta).encode("utf-8") + b"\n" + response.content
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        # Write to a temporary file first so concurrent readers never see half an entry.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data) - old_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self):
+        for root, _dirs, files in os.walk(self.path):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat
+
+    def _scan_size(self) -> int:
+        return sum(stat.st_size for _path, stat in self._entries())
+
+    def _evict(self):
+        # Remove the least recently used entries until the cache is well below its limit, so we don't
+        # need to evict on every store.
+        target = self.max_size * 0.9
+        for path, stat in sorted(self._entries(), key=lambda entry: entry[1].st_mtime):
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+                self._size -= stat.st_size
+            except OSError:
+                pass
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def response(self, entry: dict, request: requests.PreparedRequest,
+                 not_modified: requests.Response) -> requests.Response:
+        """Builds the response for a request that was answered with 304 Not Modified."""
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        # The 304 contains up to date headers such as the rate limit.
+        for name, value in not_modified.headers.items():
+            if not name.lower().startswith("content-"):
+                response.headers[name] = value
+        response._content = entry["body"]  # pylint: disable=protected-access
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = not_modified.connection
+        response.elapsed = not_modified.elapsed
+        response.from_cache = True
+        return response
+
+
+class CachingAdapter(BaseAdapter):
+    """Transport adapter that sends conditional GET requests using the validators in an `HttpCache`.
+
+    GitHub does not count 304 Not Modified responses against the rate limit. Cached responses are
+    always revalidated, so the cache never returns stale data.
+    """
+    def __init__(self, inner: BaseAdapter, cache: HttpCache):
+        super().__init__()
+        self.inner = inner
+        self.cache = cache
+
+    def send(self, request, **kwargs):
+        if request.method != "GET":
+            return self.inner.send(request, **kwargs)
+
+        key = self.cache.key(request)
+        entry = self.cache.load(key)
+        if entry:
+            if entry.get("etag"):
+                request.headers["If-None-Match"] = entry["etag"]
+            elif entry.get("last_modified"):
+                request.headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = self.inner.send(request, **kwargs)
+
+        if response.status_code == 304 and entry:
+            response.close()
+            self.cache.hit()
+            return self.cache.response(entry, request, response)
+        if response.status_code == 200 and ("ETag" in response.headers or "Last-Modified" in response.headers):
+            self.cache.store(key, response)
+        return response
+
+    def close(self):
+        self.inner.close()
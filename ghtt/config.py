@@ -1,18 +1,20 @@
 #!/usr/bin/env python3
 #%%
 import csv
+import os
 import re
+import threading
+from functools import lru_cache
 from operator import attrgetter
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from urllib.parse import urlparse
 
 import click
-from jinja2 import Template
-from natsort import natsorted
-import yaml
 
 
 class Person:
+    __slots__ = ('username', 'comment', 'record', 'group', 'groups')
+
     username: str
     comment: str
     record: dict
@@ -42,55 +44,228 @@ class StudentRepo:
         self.url = ""
 
 
-def get(keypath: str, default):
-    try:
-        with open("./ghtt.yaml") as f:
-            config = yaml.safe_load(f)
-        item = config
+class ConfigError(Exception):
+    pass
+
+
+# Expected types of the keys of `ghtt.yaml`. Keys that are not listed here are not validated.
+_SCHEMA = {
+    'url': str,
+    'source': str,
+    'default-branch': str,
+    'jobs': int,
+    'expected-group-size': int,
+    'expected-mentors-per-group': int,
+    'enable-repo-delete': bool,
+    'template-bytecode-cache': bool,
+    'allow-insecure-http': bool,
+    'http-cache-size': (int, float),
+    'rate-limit': dict,
+    'rate-limit.create-interval': (int, float),
+    'repos': dict,
+    'repos.has-issues': bool,
+    'repos.has-wiki': bool,
+    'repos.require-pull-requests': bool,
+    'repos.name-template': str,
+    'students': dict,
+    'mentors': dict,
+}
+
+
+class Config:
+    """The parsed and validated contents of `ghtt.yaml`.
+
+    Use `load()` to get the config of the current directory. It is parsed only once per process, and
+    parsed again only when the file changes.
+    """
+    def __init__(self, data: dict):
+        self.data = data
+        self.validate()
+
+    def get(self, keypath: str, default):
+        item = self.data
         for key in keypath.split("."):
+            if not isinstance(item, dict) or key not in item:
+                return default
             item = item[key]
         return item
-    except FileNotFoundError:
-        click.secho("ERROR: The config file `ghtt.yaml` was not found in the current directory.")
-        exit(1)
-    except KeyError:
-        pass
-    return default
+
+    def validate(self):
+        for keypath, expected_type in _SCHEMA.items():
+            value = self.get(keypath, None)
+            if value is None:
+                continue
+            # bool is a subclass of int, but `jobs: yes` is not a number.
+            if not isinstance(value, expected_type) or (isinstance(value, bool) and expected_type is not bool):
+                raise ConfigError("`{}` should be of type {}, but it is {!r}".format(
+                    keypath, getattr(expected_type, "__name__", "number"), value))
+        for persons_key in ('students', 'mentors'):
+            persons_config = self.get(persons_key, None)
+            if not persons_config:
+                continue
+            for keypath in ('source', 'field-mapping', 'field-mapping.username', 'field-mapping.comment'):
+                item = persons_config
+                for key in keypath.split("."):
+                    item = item.get(key) if isinstance(item, dict) else None
+                if item is None:
+                    raise ConfigError("`{}.{}` is required".format(persons_key, keypath))
+
+    @property
+    def url(self) -> str:
+        return self.get('url', "https://github.com")
+
+    @property
+    def organization(self) -> str:
+        return urlparse(self.get('url', None)).path.rstrip("/").rsplit("/", 1)[-1]
+
+    @property
+    def source(self) -> Optional[str]:
+        return self.get('source', None)
+
+    @property
+    def default_branch(self) -> str:
+        return self.get('default-branch', 'master')
+
+    @property
+    def default_branch_is_set(self) -> bool:
+        return self.get('default-branch', None) is not None
+
+    @property
+    def jobs(self) -> int:
+        return self.get('jobs', 4)
+
+    @property
+    def expected_group_size(self) -> int:
+        return self.get('expected-group-size', 1)
+
+    @property
+    def expected_mentors_per_group(self) -> int:
+        return self.get('expected-mentors-per-group', 0)
+
+    @property
+    def enable_repo_delete(self) -> bool:
+        return self.get('enable-repo-delete', False)
+
+    @property
+    def http_cache_size(self) -> float:
+        """Maximum size of the HTTP cache in MB."""
+        return self.get('http-cache-size', 100)
+
+    @property
+    def template_bytecode_cache(self) -> bool:
+        return self.get('template-bytecode-cache', False)
+
+    @property
+    def allow_insecure_http(self) -> bool:
+        """Whether an `http://` url is used as is. Otherwise ghtt always connects over https."""
+        return self.get('allow-insecure-http', False)
+
+    @property
+    def create_interval(self) -> float:
+        return self.get('rate-limit.create-interval', 0.75)
+
+    @property
+    def repos_has_issues(self) -> bool:
+        return self.get('repos.has-issues', False)
+
+    @property
+    def repos_has_wiki(self) -> bool:
+        return self.get('repos.has-wiki', False)
+
+    @property
+    def repos_require_pull_requests(self) -> bool:
+        return self.get('repos.require-pull-requests', False)
+
+    @property
+    def repos_name_template(self) -> str:
+        if self.get('students.field-mapping.group', None):
+            return self.get('repos.name-template', '{organization}-{student_group}')
+        return self.get('repos.name-template', '{organization}-{student_username}')
+
+    @property
+    def students(self) -> Optional[dict]:
+        return self.get('students', None)
+
+    @property
+    def mentors(self) -> Optional[dict]:
+        return self.get('mentors', None)
+
+
+_loaded: Dict[str, Tuple[float, Config]] = {}
+_load_lock = threading.Lock()
+
+
+def load(path: str = "./ghtt.yaml", required: bool = True) -> Config:
+    """Returns the config in `path`. The file is only parsed again when its mtime changes.
+
+    If the file doesn't exist, ghtt exits with an error, unless `required` is False. Then an empty
+    config with all the defaults is returned.
+    """
+    import yaml
+
+    with _load_lock:
+        try:
+            if not required and not os.path.exists(path):
+                return Config({})
+            mtime = os.stat(path).st_mtime
+            if path in _loaded and _loaded[path][0] == mtime:
+                return _loaded[path][1]
+            with open(path) as f:
+                config = Config(yaml.safe_load(f) or {})
+        except FileNotFoundError:
+            click.secho("ERROR: The config file `ghtt.yaml` was not found in the current directory.")
+            exit(1)
+        except (ConfigError, yaml.YAMLError) as e:
+            click.secho("ERROR: The config file `ghtt.yaml` is invalid: {}".format(e))
+            exit(1)
+        _loaded[path] = (mtime, config)
+        return config
+
+
+def get(keypath: str, default):
+    return load().get(keypath, default)
+
+
+_NON_ALPHANUMERIC = re.compile("[^0-9a-z]+")
+
+
+@lru_cache(maxsize=None)
+def canonize_group(group: str) -> str:
+    return _NON_ALPHANUMERIC.sub("-", group.lower())
 
 
 def get_persons(persons_config: dict, usernames: List[str] = [], groups: List[str] = []) -> List[Person]:
-    def canonize_group(group):
-        return re.sub("[^0-9a-z]+", "-", group.lower())
+    from jinja2 import Template
 
-    canonized_groups = [canonize_group(g) for g in groups] if groups else []
+    usernames = set(usernames) if usernames else None
+    canonized_groups = {canonize_group(g) for g in groups} if groups else None
 
     persons = []
     if not persons_config:
         return persons
     mapping = persons_config['field-mapping']
+    username_field = mapping['username']
+    group_field = mapping.get("group")
+    groups_field = mapping.get("groups")
+    comment_template = Template(mapping["comment"])
     try:
-        with open(persons_config["source"]) as f:
+        with open(persons_config["source"], newline='') as f:
             rows = csv.DictReader(f, delimiter=',', quotechar='"')
             for row in rows:
-                person = Person(row[mapping['username']], )
-                person.username = person.username.strip("#")
-                if usernames and person.username not in usernames:
+                username = row[username_field].strip("#")
+                if usernames is not None and username not in usernames:
                     continue
-                person.record = row
-                person.comment = Template(mapping["comment"]).render(record=person.record)
-                if mapping.get("group"):
-                    person.group = person.record[mapping['group']]
-                    person.group = canonize_group(person.group)
-                    if person.group == "":
-                        person.group = None
-                    if canonized_groups and person.group not in canonized_groups:
+                group = None
+                if group_field:
+                    group = canonize_group(row[group_field]) or None
+                    if canonized_groups is not None and group not in canonized_groups:
                         continue
-                if mapping.get("groups"):
-                    person.groups = person.record[mapping['groups']].split(",")
-                    if person.groups == "":
-                        person.groups = []
-                    person.groups = [group.strip() for group in person.groups]
-                    person.groups = [canonize_group(group) for group in person.groups]
+                person = Person(username)
+                person.record = row
+                person.comment = comment_template.render(record=row)
+                person.group = group
+                if groups_field:
+                    person.groups = [canonize_group(gr.strip()) for gr in row[groups_field].split(",") if gr.strip()]
                 persons.append(person)
     except FileNotFoundError:
         click.secho("The student database '{}' was not found".format(persons_config['source']))
@@ -99,17 +274,19 @@ def get_persons(persons_config: dict, usernames: List[str] = [], groups: List[st
 
 
 def get_students(usernames: List[str] = [], groups: List[str] = []) -> List[Person]:
-    student_config = get("students", None)
+    from natsort import natsorted
+
+    student_config = load().students
     return natsorted(get_persons(student_config, usernames, groups), key=attrgetter('group', 'username'))
 
 
 def get_mentors(usernames: List[str] = [], groups: List[str] = []) -> List[Person]:
-    config = get("mentors", None)
+    config = load().mentors
     return get_persons(config, usernames, groups)
 
 
 def get_organization() -> str:
-    return urlparse(get("url", None)).path.rstrip("/").rsplit("/", 1)[-1]
+    return load().organization
 
 
 def make_repo_name(template: str, organization: str, student_username: str, student_group: Optional[str]) -> str:
@@ -124,32 +301,38 @@ def get_repos(students: List[Person], mentors: Optional[List[Person]] = None) ->
         mentors = []
     click.secho('get_repos with {} students and {} mentors'.format(len(students), len(mentors)))
     repos = {}
-    student_config = get("students", None)
+    config = load()
+    student_config = config.students
     # if not student_config:
     # return students  # wrong type
     assert student_config
     mapping = student_config['field-mapping']
 
-    organization = get_organization()
+    organization = config.organization
+    reponame_template = config.repos_name_template
+    url = config.url
+
+    mentors_by_group: Dict[str, List[Person]] = {}
+    for mentor in mentors:
+        for group in dict.fromkeys(mentor.groups):
+            mentors_by_group.setdefault(group, []).append(mentor)
 
     for student in students:
         if mapping.get("group"):
             if not student.group:
                 click.secho("{} is not a member of any group; skipping.".format(student.username))
                 continue
-            reponame_template = get('repos.name-template', '{organization}-{student_group}')
             reponame = make_repo_name(reponame_template, organization, student.username, student.group)
-            repo = repos.get(reponame, StudentRepo(reponame))
+            repo = repos.get(reponame) or StudentRepo(reponame)
         else:
-            reponame_template = get('repos.name-template', '{organization}-{student_username}')
             reponame = make_repo_name(reponame_template, organization, student.username, student.group)
             repo = StudentRepo(reponame)
         repo.students.append(student)
         repo.group = student.group
         repo.comment = ", ".join([s.comment for s in repo.students])
         repo.organization = organization
-        repo.url = "{}/{}".format(get("url", None), repo.name)
-        repo.mentors = [m for m in mentors if repo.group in m.groups]
+        repo.url = "{}/{}".format(url, repo.name)
+        repo.mentors = list(mentors_by_group.get(repo.group, []))
         repos[repo.name] = repo
 
     return repos
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+import os
+import shlex
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import jinja2
+
+import ghtt.pool
+import ghtt.templating
+
+
+TEMPLATE_SUFFIX = ".jinja"
+
+# Number of seconds a shared SSH connection stays open after the last push that used it.
+SSH_CONTROL_PERSIST = 10
+
+# Entry that removes a path from the index with `git update-index --index-info`.
+_REMOVE_ENTRY = "0 0000000000000000000000000000000000000000\t{}"
+
+
+def _git(source: str, args: List[str], input: Optional[bytes] = None, env: Optional[Dict[str, str]] = None) -> bytes:
+    result = subprocess.run(
+        ["git"] + args, cwd=source, input=input, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, ["git"] + args, result.stdout, result.stderr)
+    return result.stdout
+
+
+def resolve_commit(source: str, rev: str) -> Optional[str]:
+    """Returns the SHA of the commit `rev` in the source repository, or None if it doesn't exist."""
+    try:
+        return _git(source, ["rev-parse", "--verify", "--quiet", rev + "^{commit}"]).decode().strip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+class TemplateFile:
+    """A `.jinja` file in the tree of the source commit."""
+    __slots__ = ('path', 'mode', 'source', 'template')
+
+    def __init__(self, path: str, mode: str, source: str):
+        self.path = path
+        self.mode = mode
+        self.source = source
+        self.template: jinja2.Template = ghtt.templating.get_template(source)
+
+    @property
+    def destination(self) -> str:
+        return self.path[:-len(TEMPLATE_SUFFIX)]
+
+
+class TemplateManifest:
+    """The templates in a commit of the source repository, prepared once per run.
+
+    It holds the compiled `.jinja` files and the tree of the commit without them, so generating the
+    commit of a student repo only needs to render the templates and add the results to that tree.
+    """
+    def __init__(self, source: str, commit: str):
+        self.source = source
+        self.commit = commit
+        self.templates: List[TemplateFile] = []
+
+        entries = []
+        listing = _git(source, ["ls-tree", "-r", "-z", "--full-tree", commit])
+        for entry in listing.split(b"\0"):
+            if not entry:
+                continue
+            info, path = entry.split(b"\t", 1)
+            mode, kind, sha = info.decode().split()
+            path = path.decode("utf-8", "surrogateescape")
+            if kind == "blob" and path.endswith(TEMPLATE_SUFFIX):
+                entries.append((path, mode, sha))
+
+        contents = _read_blobs(source, [sha for path, mode, sha in entries])
+        for path, mode, sha in entries:
+            self.templates.append(TemplateFile(path, mode, contents[sha].decode("utf-8")))
+        self.base_tree = _write_tree(source, commit, [_REMOVE_ENTRY.format(path) for path, mode, sha in entries])
+
+
+def _read_blobs(source: str, shas: List[str]) -> Dict[str, bytes]:
+    """Reads the contents of blobs with a single `git cat-file --batch`."""
+    output = _git(source, ["cat-file", "--batch"], input="".join(sha + "\n" for sha in shas).encode())
+    contents = {}
+    position = 0
+    for sha in shas:
+        header_end = output.index(b"\n", position)
+        size = int(output[position:header_end].split()[2])
+        contents[sha] = output[header_end + 1:header_end + 1 + size]
+        position = header_end + 1 + size + 1
+    return contents
+
+
+def _write_tree(source: str, tree: str, entries: List[str]) -> str:
+    """Writes the tree that results from applying `git update-index --index-info` entries to `tree`.
+
+    This uses a temporary index, so neither the working directory nor the index of the source
+    repository are touched, and several trees can be written at the same time.
+    """
+    with tempfile.TemporaryDirectory(prefix="ghtt-") as directory:
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(directory, "index"))
+        _git(source, ["read-tree", tree], env=env)
+        if entries:
+            _git(source, ["update-index", "--index-info"], input="\n".join(entries).encode("utf-8", "surrogateescape") + b"\n", env=env)
+        return _git(source, ["write-tree"], env=env).decode().strip()
+
+
+def generate_commit(manifest: TemplateManifest, rendered: Dict[TemplateFile, str], message: str = "fill in templates") -> str:
+    """Creates a commit on top of the manifest's commit in which each template file is replaced by
+    its rendered content, and returns its SHA.
+    """
+    if not rendered:
+        return manifest.commit
+
+    entries = []
+    for template, content in rendered.items():
+        sha = _git(manifest.source, ["hash-object", "-w", "--stdin"], input=content.encode("utf-8")).decode().strip()
+        entries.append("{} {}\t{}".format(template.mode, sha, template.destination))
+    tree = _write_tree(manifest.source, manifest.base_tree, entries)
+    return _git(manifest.source, ["commit-tree", tree, "-p", manifest.commit, "-m", message]).decode().strip()
+
+
+def push(source: str, commit: str, url: str, branch: str, env: Optional[Dict[str, str]] = None):
+    """Pushes `commit` to `branch` of the repository at `url`."""
+    ghtt.pool.check_call(["git", "push", url, "{}:refs/heads/{}".format(commit, branch)], cwd=source, env=env)
+
+
+def _ssh_command(source: Optional[str], env: Dict[str, str]) -> Optional[str]:
+    """Returns the SSH command git would use in `source`, or None if that is a GIT_SSH program."""
+    if "GIT_SSH_COMMAND" in env:
+        return env["GIT_SSH_COMMAND"]
+    try:
+        # The git config can set e.g. the key to use: `ssh -i ~/.ssh/course_key`.
+        configured = _git(source or ".", ["config", "core.sshCommand"], env=env).decode().strip()
+    except (subprocess.CalledProcessError, OSError):  # not a repository, or it doesn't exist
+        configured = ""
+    if configured:
+        return configured
+    # A custom GIT_SSH program can't be given options, so leave that alone.
+    return None if "GIT_SSH" in env else "ssh"
+
+
+@contextmanager
+def ssh_multiplexing(source: Optional[str] = None):
+    """Yields the environment for git commands that share one SSH connection per host, instead of
+    doing an SSH handshake for every push. The SSH command git would use in `source` is kept.
+    """
+    # The socket path must fit in the 104 bytes of `sun_path` on macOS, where $TMPDIR is long, and
+    # ssh appends a random suffix to it while connecting.
+    short_tmp = "/tmp" if os.path.isdir("/tmp") else None
+    with tempfile.TemporaryDirectory(prefix="ghtt-ssh-", dir=short_tmp) as directory:
+        env = dict(os.environ)
+        ssh_command = _ssh_command(source, env)
+        if ssh_command is not None:
+            # GIT_SSH_COMMAND overrides core.sshCommand, so it has to include that command.
+            env["GIT_SSH_COMMAND"] = "{} -o ControlMaster=auto -o ControlPath={} -o ControlPersist={}".format(
+                ssh_command, shlex.quote(os.path.join(directory, "%C")), SSH_CONTROL_PERSIST)
+        yield env
+
+
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import base64
+import hashlib
+import os
+import stat
+from typing import Callable, Dict, List
+
+import github
+
+import ghtt.templating
+from ghtt.generate import TEMPLATE_SUFFIX
+
+
+class File:
+    """A file to add to the student repositories. Templates are rendered for each repository."""
+    __slots__ = ('path', 'mode', 'content', 'template')
+
+    def __init__(self, path: str, mode: str, content: bytes):
+        self.path = path
+        self.mode = mode
+        self.content = content
+        self.template = None
+        if path.endswith(TEMPLATE_SUFFIX):
+            self.path = path[:-len(TEMPLATE_SUFFIX)]
+            self.template = ghtt.templating.get_template(content.decode("utf-8"))
+
+
+def read_files(directory: str) -> List[File]:
+    """Reads all files in `directory` once, so they can be sent to any number of repositories."""
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d != ".git")
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            mode = "100755" if os.stat(path).st_mode & stat.S_IXUSR else "100644"
+            with open(path, "rb") as f:
+                files.append(File(os.path.relpath(path, directory).replace(os.sep, "/"), mode, f.read()))
+    return files
+
+
+def _is_text(content: bytes) -> bool:
+    if b"\0" in content:
+        return False
+    try:
+        content.decode("utf-8")
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+class Blobs:
+    """Encodes the binary files of a run once. The Git Data API stores blobs per repository, so
+    each repository still needs its own upload, but files with identical content share one upload.
+    """
+    def __init__(self):
+        self._encoded: Dict[str, str] = {}
+
+    def encoded(self, content: bytes) -> str:
+        key = hashlib.sha1(content).hexdigest()
+        if key not in self._encoded:
+            self._encoded[key] = base64.b64encode(content).decode("ascii")
+        return self._encoded[key]
+
+    def upload(self, g_repo: github.Repository.Repository, contents: List[bytes]) -> Dict[bytes, str]:
+        """Creates a blob for each distinct content in the repository and returns their SHAs."""
+        shas = {}
+        for content in contents:
+            if content not in shas:
+                shas[content] = g_repo.create_git_blob(self.encoded(content), "base64").sha
+        return shas
+
+
+def create_branch(g_repo: github.Repository.Repository, files: List[File], blobs: Blobs,
+                  render: Callable, parent_sha: str, parent_tree_sha: str,
+                  branch: str, message: str) -> str:
+    """Creates `branch` in the repository with a commit that adds `files` on top of the commit
+    `parent_sha`, using only the Git Data API. Text files are sent inline with the tree; binary
+    files are uploaded as blobs first. Returns the SHA of the new commit.
+
+    `render` is called with each template and returns its rendered content for this repository.
+    """
+    contents = [(f, render(f.template).encode("utf-8") if f.template else f.content) for f in files]
+    binary_shas = blobs.upload(g_repo, [content for f, content in contents if not _is_text(content)])
+
+    entries = []
+    for f, content in contents:
+        entry = {"path": f.path, "mode": f.mode, "type": "blob"}
+        if content in binary_shas:
+            entry["sha"] = binary_shas[content]
+        else:
+            entry["content"] = content.decode("utf-8")
+        entries.append(entry)
+
+    requester = g_repo.requester
+    headers, tree = requester.requestJsonAndCheck(
+        "POST", g_repo.url + "/git/trees", input={"tree": entries, "base_tree": parent_tree_sha})
+    headers, commit = requester.requestJsonAndCheck(
+        "POST", g_repo.url + "/git/commits", input={"message": message, "tree": tree["sha"], "parents": [parent_sha]})
+    g_repo.create_git_ref("refs/heads/{}".format(branch), commit["sha"])
+    return commit["sha"]
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import json
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import github
+
+
+# GitHub allows up to 100 repositories in a single query without running into node limits.
+BATCH_SIZE = 100
+
+_COMMIT_FIELDS = """
+    nameWithOwner
+    defaultBranchRef {
+      target {
+        ... on Commit {
+          oid
+          tree { oid }
+          messageHeadline
+          committedDate
+          author { name email date }
+        }
+      }
+    }
+"""
+
+
+class CommitInfo:
+    """Metadata of the head commit of the default branch of a repository."""
+    __slots__ = ('sha', 'tree_sha', 'author_name', 'author_email', 'authored_date', 'committed_date', 'message')
+
+    def __init__(self, target: dict):
+        self.sha: str = target['oid']
+        self.tree_sha: str = target['tree']['oid']
+        self.message: str = target['messageHeadline']
+        self.committed_date: datetime = _parse_date(target['committedDate'])
+        author = target.get('author') or {}
+        self.author_name: Optional[str] = author.get('name')
+        self.author_email: Optional[str] = author.get('email')
+        self.authored_date: Optional[datetime] = _parse_date(author['date']) if author.get('date') else None
+
+
+def _parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _batches(items: List, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def last_commits(g: github.Github, full_names: Iterable[str]) -> Dict[str, Optional[CommitInfo]]:
+    """Returns the head commit of the default branch of each repository ("owner/name"), using one
+    GraphQL query for every 100 repositories. Repositories that don't exist, or that don't have any
+    commits, map to None.
+    """
+    full_names = list(dict.fromkeys(full_names))
+    result: Dict[str, Optional[CommitInfo]] = {}
+    for batch in _batches(full_names, BATCH_SIZE):
+        fields = []
+        for i, full_name in enumerate(batch):
+            owner, name = full_name.split("/", 1)
+            # JSON strings are valid GraphQL strings
+            fields.append("r{}: repository(owner: {}, name: {}) {{{}}}".format(
+                i, json.dumps(owner), json.dumps(name), _COMMIT_FIELDS))
+        data = _query(g, "query {\n" + "\n".join(fields) + "\n}")
+        for i, full_name in enumerate(batch):
+            repository = data.get("r{}".format(i))
+            target = ((repository or {}).get("defaultBranchRef") or {}).get("target")
+            result[full_name] = CommitInfo(target) if target else None
+    return result
+
+
+def _query(g: github.Github, query: str) -> dict:
+    requester = g.requester
+    headers, data = requester.requestJsonAndCheck("POST", requester.graphql_url, input={"query": query})
+    # Missing repositories are reported as errors next to the data of the other repositories.
+    errors = [error for error in data.get("errors", []) if error.get("type") != "NOT_FOUND"]
+    if errors or data.get("data") is None:
+        raise requester.createException(400, headers, data)
+    return data["data"]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional
+
+import click
+
+import ghtt.config
+import ghtt.trace
+
+
+_local = threading.local()
+_output_lock = threading.Lock()
+
+
+# Adds the `--jobs` option to a command. It is passed to the command as the `jobs` argument.
+jobs_option = click.option(
+    '--jobs', '-j',
+    help='Number of repositories to process at the same time. Defaults to the `jobs` key of '
+         'ghtt.yaml, or 4.',
+    type=click.IntRange(min=1),
+    default=lambda: ghtt.config.load(required=False).jobs)
+
+
+def current_repo() -> Optional[str]:
+    """Returns the name of the repository the current thread is working on, if any."""
+    return getattr(_local, 'repo', None)
+
+
+def secho(message=None, **styles):
+    """Same as `click.secho`, but output of a repository job is buffered and printed in one block
+    when the job finishes, so output of concurrent jobs doesn't get mixed up.
+    """
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        click.secho(message, **styles)
+    else:
+        buffer.append((message, styles))
+
+
+def check_call(command: List[str], cwd=None, env=None):
+    """Same as `subprocess.check_call`, but the output of the command is added to the output of the
+    current repository job.
+    """
+    if getattr(_local, 'buffer', None) is None:
+        return subprocess.check_call(command, cwd=cwd, env=env)
+    result = subprocess.run(command, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    if result.stdout:
+        secho(result.stdout.rstrip("\n"))
+    result.check_returncode()
+    return result.returncode
+
+
+def _run_job(name: str, work: Callable, item, buffered: bool):
+    _local.repo = name
+    _local.buffer = [] if buffered else None
+    try:
+        with ghtt.trace.phase("span"):
+            work(item)
+    finally:
+        buffer = _local.buffer
+        _local.repo = None
+        _local.buffer = None
+        if buffer:
+            with _output_lock:
+                for message, styles in buffer:
+                    click.secho(message, **styles)
+
+
+def run_per_repo(items: Iterable, work: Callable, jobs: int = 1,
+                 name: Callable = lambda item: item.name) -> Dict[str, BaseException]:
+    """Calls `work(item)` for each item using a pool of `jobs` threads.
+
+    The work function must not ask the user anything; use a `ProceedAsker` to select the items
+    before calling this. A failure of one item does not stop the others. When all items are done, a
+    summary of the failed items is printed and returned as a dict of item name to exception.
+    """
+    items = list(items)
+    failures = {}
+    buffered = jobs > 1 and len(items) > 1
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_run_job, name(item), work, item, buffered): name(item) for item in items}
+        try:
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:  # pylint: disable=broad-except
+                    failures[futures[future]] = e
+                    with _output_lock:
+                        click.secho("Error while processing {}: {}".format(futures[future], e), fg="red")
+        except BaseException:
+            # On Ctrl-C, only wait for the running jobs instead of the whole queue. This is what
+            # `shutdown(cancel_futures=True)` does, which needs Python 3.9.
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+            raise
+
+    if failures:
+        click.secho("\n# {} of {} repositories failed:".format(len(failures), len(items)), fg="red")
+        for item_name, error in sorted(failures.items()):
+            click.secho("   - {}: {}".format(item_name, error), fg="red")
+    return failures
+
+
+def exit_on_failures(*failures: Dict[str, BaseException]):
+    """Exits with a non-zero status if any of the `run_per_repo` results has failed items, so
+    scripts can tell that a command didn't fully succeed. Call this after the command's summary.
+    """
+    failed = sum(len(f) for f in failures)
+    if failed:
+        raise click.ClickException("{} job(s) failed".format(failed))
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import click
+from requests.adapters import BaseAdapter
+
+import ghtt.pool
+import ghtt.trace
+
+
+# Requests that create or change content, e.g. a PUT on collaborators creates an invitation. GitHub's
+# secondary rate limits count all of these as content creation. GraphQL queries are POST requests
+# too, but ghtt only reads with them, so they aren't paced like this.
+CREATE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# Minimum number of seconds between two requests to a rate limit resource. The search API allows 30
+# requests per minute.
+RESOURCE_INTERVALS = {"search": 60 / 30}
+
+# Time to wait after a secondary rate limit when GitHub doesn't send `Retry-After`. This is doubled
+# for each retry.
+SECONDARY_LIMIT_BACKOFF = 60.0
+
+
+def _resource(url: str) -> str:
+    """Returns the rate limit resource a request counts against."""
+    path = urlparse(url).path
+    if "/search/" in path:
+        return "search"
+    if path.endswith("/graphql"):
+        return "graphql"
+    return "core"
+
+
+class _Budget:
+    def __init__(self):
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset: Optional[int] = None
+        self.in_flight = 0
+        self.used = 0
+
+
+class RateLimiter:
+    """Schedules requests so they stay within GitHub's rate limits.
+
+    The limiter tracks the `X-RateLimit-*` headers of each rate limit resource (core, search,
+    graphql). When a budget is used up, requests wait until it resets instead of failing. Requests
+    that hit a secondary rate limit wait for `Retry-After` (or back off exponentially) and are sent
+    again. Content-changing REST requests are spaced at least `create_interval` seconds apart, and
+    search requests are spread over the minute.
+    """
+    def __init__(self, create_interval: float = 0.75, max_retries: int = 5):
+        self.create_interval = create_interval
+        self.max_retries = max_retries
+        self.requests = 0
+        self.requests_by_repo: Dict[str, int] = {}
+        self.waited = 0.0
+        self._budgets: Dict[str, _Budget] = {}
+        self._paused_until = 0.0
+        self._next_slot: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _budget(self, resource: str) -> _Budget:
+        if resource not in self._budgets:
+            self._budgets[resource] = _Budget()
+        return self._budgets[resource]
+
+    def wait(self, seconds: float, reason: str):
+        if seconds <= 0:
+            return
+        if seconds >= 5:
+            click.secho("Waiting {:.0f}s for the GitHub {}..".format(seconds, reason), fg="yellow", err=True)
+        with ghtt.trace.phase("rate limit wait", reason=reason):
+            time.sleep(seconds)
+        with self._lock:
+            self.waited += seconds
+
+    def before(self, request):
+        """Blocks until the request can be sent."""
+        resource = _resource(request.url)
+        while True:
+            with self._lock:
+                now = time.time()
+                budget = self._budget(resource)
+                if self._paused_until > now:
+                    delay, reason = self._paused_until - now, "secondary rate limit"
+                elif (budget.remaining is not None and budget.reset and budget.reset > now
+                      and budget.remaining - budget.in_flight <= 0):
+                    delay, reason = budget.reset - now + 1, "{} rate limit to reset".format(resource)
+                else:
+                    budget.in_flight += 1
+                    self.requests += 1
+                    repo = ghtt.pool.current_repo()
+                    if repo is not None:
+                        self.requests_by_repo[repo] = self.requests_by_repo.get(repo, 0) + 1
+                    delay = 0
+                    if request.method in CREATE_METHODS and resource != "graphql":
+                        delay = self._reserve_slot("create", self.create_interval, now)
+                    if resource in RESOURCE_INTERVALS:
+                        delay = max(delay, self._reserve_slot(resource, RESOURCE_INTERVALS[resource], now))
+                    break
+            self.wait(delay, reason)
+        self.wait(delay, "pacing of requests")
+
+    def _reserve_slot(self, key: str, interval: float, now: float) -> float:
+        """Reserves the next free time slot for a paced kind of request. Returns the delay until
+        that slot.
+        """
+        slot = max(self._next_slot.get(key, 0.0), now)
+        self._next_slot[key] = slot + interval
+        return slot - now
+
+    def failed(self, request):
+        """Marks a request that got no response (e.g. a connection error) as no longer in flight."""
+        with self._lock:
+            self._budget(_resource(request.url)).in_flight -= 1
+
+    def after(self, request, response, attempt: int) -> Optional[float]:
+        """Updates the budget using the response headers. Returns the number of seconds to wait
+        before retrying when the request hit a rate limit, or None when it didn't.
+        """
+        headers = response.headers
+        with self._lock:
+            budget = self._budget(_resource(request.url))
+            budget.in_flight -= 1
+            if "X-RateLimit-Remaining" in headers:
+                remaining = int(headers["X-RateLimit-Remaining"])
+                reset = int(headers.get("X-RateLimit-Reset", 0))
+                limit = int(headers.get("X-RateLimit-Limit", budget.limit or 0))
+                if budget.remaining is None:
+                    # 304 Not Modified responses don't count against the rate limit.
+                    budget.used += 0 if getattr(response, "from_cache", False) else 1
+                    budget.limit, budget.remaining, budget.reset = limit, remaining, reset
+                elif reset > budget.reset:  # a new rate limit window started
+                    budget.used += max(limit - remaining, 0)
+                    budget.limit, budget.remaining, budget.reset = limit, remaining, reset
+                elif reset == budget.reset and remaining < budget.remaining:
+                    # Responses to concurrent requests can arrive out of order, so older responses
+                    # with a higher remaining count are ignored.
+                    budget.used += budget.remaining - remaining
+                    budget.remaining = remaining
+
+            if response.status_code not in (403, 429):
+                return None
+            now = time.time()
+            if headers.get("X-RateLimit-Remaining") == "0" and "Retry-After" not in headers:
+                # The primary rate limit; `before()` makes the retry wait until the reset.
+                return 0
+            if "Retry-After" in headers:
+                delay = float(headers["Retry-After"])
+            elif "rate limit" in response.text.lower():
+                delay = SECONDARY_LIMIT_BACKOFF * 2 ** attempt
+            else:
+                return None  # a 403 that has nothing to do with rate limits
+            # Secondary rate limits apply to all requests, so pause them all.
+            self._paused_until = max(self._paused_until, now + delay)
+            return delay
+
+    def report(self) -> str:
+        """Returns a summary of the requests and the rate limit budget used so far."""
+        summary = "# GitHub API: {} requests".format(self.requests)
+        for resource, budget in sorted(self._budgets.items()):
+            if budget.remaining is not None:
+                summary += ", {} budget used: {} (remaining {}/{})".format(
+                    resource, budget.used, budget.remaining, budget.limit)
+        if self.requests_by_repo:
+            busiest = max(self.requests_by_repo, key=self.requests_by_repo.get)
+            summary += ", per repo: {:.1f} on average, {} at most ({})".format(
+                sum(self.requests_by_repo.values()) / len(self.requests_by_repo),
+                self.requests_by_repo[busiest], busiest)
+        if self.waited:
+            summary += ", waited {:.0f}s for rate limits".format(self.waited)
+        return summary
+
+
+class RateLimitAdapter(BaseAdapter):
+    """Transport adapter that sends every request through a `RateLimiter` and retries requests
+    that hit a rate limit.
+    """
+    def __init__(self, inner: BaseAdapter, limiter: RateLimiter):
+        super().__init__()
+        self.inner = inner
+        self.limiter = limiter
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            self.limiter.before(request)
+            try:
+                response = self.inner.send(request, **kwargs)
+            except BaseException:
+                self.limiter.failed(request)
+                raise
+            delay = self.limiter.after(request, response, attempt)
+            if delay is None or attempt >= self.limiter.max_retries:
+                return response
+            response.close()
+            self.limiter.wait(delay, "rate limit")
+            attempt += 1
+
+    def close(self):
+        self.inner.close()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+from typing import Dict, Iterator, Optional
+
+import click
+import github
+
+
+class OrgRepoIndex:
+    """Index of all repositories of an organization, built from a single paginated listing.
+
+    Looking up a repository in the index costs no API calls, so use this instead of
+    `g_org.get_repo()` to check whether a student repository exists. The indexed repositories
+    contain the metadata of the listing (urls, description, default branch, ...).
+    """
+    def __init__(self, g_org: github.Organization.Organization):
+        self.g_org = g_org
+        click.secho("# Listing repositories of {}..".format(g_org.login), fg="green")
+        # GitHub repository names are case insensitive.
+        self._repos: Dict[str, github.Repository.Repository] = {
+            g_repo.name.lower(): g_repo for g_repo in g_org.get_repos('all')
+        }
+
+    def get(self, name: str) -> Optional[github.Repository.Repository]:
+        return self._repos.get(name.lower())
+
+    def add(self, g_repo: github.Repository.Repository):
+        self._repos[g_repo.name.lower()] = g_repo
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self._repos
+
+    def __iter__(self) -> Iterator[github.Repository.Repository]:
+        return iter(list(self._repos.values()))
+
+    def __len__(self) -> int:
+        return len(self._repos)
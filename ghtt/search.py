@@ -2,25 +2,38 @@
 import subprocess
 from functools import wraps
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import click
 import github
 import requests
-from typing import List
+from typing import Iterator, List
 
 from .auth import needs_auth
+from .pool import jobs_option
+import ghtt.graphql
+
+
+# Number of repositories to fetch the last commit of in one request. Smaller chunks are fetched
+# concurrently, so the first results are printed sooner.
+METADATA_CHUNK_SIZE = 20
+
+# The search API only returns the first 1000 results of a query.
+SEARCH_RESULT_LIMIT = 1000
 
 
-def notify(api_key, domain_name, to, repos, query):
+def notify(api_key, domain_name, to, repos, commits, query):
     url = 'https://api.mailgun.net/v3/{}/messages'.format(domain_name)
     auth = ('api', api_key)
 
     text = ""
     for g_repo in repos:
         text = text + g_repo.html_url
-        g_commit = g_repo.get_branch(g_repo.default_branch).commit
-        text = text + "\nMetadata of last commit:"
-        text = text + "\n\tAuthor name: {}".format(g_commit.commit.author.name)
-        text = text + "\n\tAuthor email: {}".format(g_commit.commit.author.email)
+        commit = commits.get(g_repo.full_name)
+        if commit:
+            text = text + "\nMetadata of last commit:"
+            text = text + "\n\tAuthor name: {}".format(commit.author_name)
+            text = text + "\n\tAuthor email: {}".format(commit.author_email)
         text = text + "\n"
 
     data = {
@@ -34,12 +47,36 @@ def notify(api_key, domain_name, to, repos, query):
     response.raise_for_status()
 
 
-def repos_matching(g : github.Github, query) -> List[github.Repository.Repository]:
-    repos = list()
+def repos_matching(g : github.Github, query) -> Iterator[List[github.Repository.Repository]]:
+    """Yields the repositories that match the query, one page of search results at a time. Each
+    repository is only yielded once, even if multiple files in it match.
+    """
+    seen = set()
     results = g.search_code(query)
-    for result in results:
-        repos.append(result.repository)
-    return repos
+    page = 0
+    while True:
+        # Pages are only requested when the previous one has been processed.
+        hits = results.get_page(page)
+        repos = []
+        for hit in hits:
+            if hit.repository.full_name not in seen:
+                seen.add(hit.repository.full_name)
+                repos.append(hit.repository)
+        if repos:
+            yield repos
+        page += 1
+        if len(hits) < g.per_page or page * g.per_page >= SEARCH_RESULT_LIMIT:
+            return
+
+
+def print_repo(g_repo: github.Repository.Repository, commit: ghtt.graphql.CommitInfo):
+    click.secho(g_repo.html_url, fg="red")
+    if commit is None:
+        click.secho("Repository has no commits\n")
+        return
+    click.secho("Metadata of last commit:")
+    click.secho("\tAuthor name: {}".format(commit.author_name))
+    click.secho("\tAuthor email: {}\n".format(commit.author_email))
 
 
 @click.command()
@@ -57,8 +94,9 @@ def repos_matching(g : github.Github, query) -> List[github.Repository.Repositor
 @click.option(
     '--to',
     help='Email address to send alert to.')
+@jobs_option
 @needs_auth
-def search(ctx, query, mg_api_key, mg_domain, to):
+def search(ctx, query, mg_api_key, mg_domain, to, jobs):
     """Searches repositories matching the query,
     prints the matching repositories, name and email address of the last committer,
     and optionally emails this info using Mailgun.
@@ -77,18 +115,30 @@ def search(ctx, query, mg_api_key, mg_domain, to):
     g : github.Github = ctx.obj['pyg']
 
     # https://developer.github.com/v3/search/#considerations-for-code-search
-    g_repos = repos_matching(g, query)
+    # The last commits of a page of results are fetched while the next page is being searched, and
+    # each repository is printed as soon as its metadata arrives. The rate limiter keeps the search
+    # requests within the budget of the code search API.
+    g_repos = []
+    commits = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for page in repos_matching(g, query):
+            g_repos.extend(page)
+            for start in range(0, len(page), METADATA_CHUNK_SIZE):
+                chunk = page[start:start + METADATA_CHUNK_SIZE]
+                futures[executor.submit(ghtt.graphql.last_commits, g, [g_repo.full_name for g_repo in chunk])] = chunk
+            for future in [f for f in futures if f.done()]:
+                commits.update(future.result())
+                for g_repo in futures.pop(future):
+                    print_repo(g_repo, commits[g_repo.full_name])
+        for future in as_completed(futures):
+            commits.update(future.result())
+            for g_repo in futures[future]:
+                print_repo(g_repo, commits[g_repo.full_name])
+
     if not g_repos:
         click.secho("no results")
-    for g_repo in g_repos:
-        click.secho(g_repo.html_url, fg="red")
-
-        click.secho("Metadata of last commit:")
-        g_commit = g_repo.get_branch(g_repo.default_branch).commit
-        click.secho("\tAuthor name: {}".format(g_commit.commit.author.name))
-        click.secho("\tAuthor email: {}\n".format(g_commit.commit.author.email))
-
 
     if g_repos and mg_api_key and mg_domain and to:
         click.secho("Sending email")
-        notify(mg_api_key, mg_domain, to, g_repos, query)
\ No newline at end of file
+        notify(mg_api_key, mg_domain, to, g_repos, commits, query)
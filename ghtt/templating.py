@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import threading
+
+import jinja2
+import jinja2.meta
+
+import ghtt.config
+
+
+# Variables that are different for each student repository.
+REPO_VARIABLES = frozenset(["clone_url", "group", "students", "mentors", "repo"])
+
+
+class _SourceLoader(jinja2.BaseLoader):
+    """Loads templates from sources registered by `get_template`. Templates are named after the hash
+    of their source, so a template never gets out of date.
+    """
+    def __init__(self):
+        self.sources = {}
+
+    def get_source(self, environment, template):
+        if template not in self.sources:
+            raise jinja2.TemplateNotFound(template)
+        return self.sources[template], None, lambda: True
+
+
+_loader = _SourceLoader()
+_environment = None
+_environment_lock = threading.Lock()
+
+
+def environment() -> jinja2.Environment:
+    """Returns the Jinja environment shared by all templates. It caches compiled templates, and also
+    stores them on disk if `template-bytecode-cache` is enabled in ghtt.yaml.
+    """
+    global _environment
+    with _environment_lock:
+        if _environment is None:
+            bytecode_cache = None
+            if ghtt.config.load(required=False).template_bytecode_cache:
+                cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+                directory = os.path.join(cache_home, "ghtt", "jinja")
+                os.makedirs(directory, exist_ok=True)
+                bytecode_cache = jinja2.FileSystemBytecodeCache(directory)
+            _environment = jinja2.Environment(loader=_loader, cache_size=1000, bytecode_cache=bytecode_cache)
+        return _environment
+
+
+def get_template(source: str) -> jinja2.Template:
+    """Returns the compiled template for `source`. Each source is only compiled once."""
+    name = hashlib.sha1(source.encode("utf-8")).hexdigest()
+    _loader.sources[name] = source
+    return environment().get_template(name)
+
+
+def is_repo_invariant(source: str) -> bool:
+    """Returns True if the template renders the same for each student repository, because it
+    doesn't use any of the per-repo variables.
+    """
+    variables = jinja2.meta.find_undeclared_variables(environment().parse(source))
+    return not (variables & REPO_VARIABLES)
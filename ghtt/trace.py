@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+import json
+import re
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import click
+
+import ghtt.pool
+
+
+class Tracer:
+    """Writes an event for every HTTP request, git command, template rendering, rate limit wait and
+    repository job to a file (one JSON object per line), and keeps totals for the summary.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.start = time.perf_counter()
+        self.phases: Dict[str, List[float]] = {}  # phase -> [count, seconds]
+        self.endpoints: Dict[str, List[float]] = {}  # endpoint -> [count, seconds]
+        self.repos: Dict[str, float] = {}
+        self._file = open(path, "w")
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, started: float, duration: float, **fields):
+        event = dict(type=kind, start=round(started - self.start, 6), duration=round(duration, 6),
+                     repo=ghtt.pool.current_repo(), **fields)
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            if kind == "span":
+                self.repos[event["repo"]] = duration
+                return
+            totals = self.phases.setdefault(kind, [0, 0.0])
+            totals[0] += 1
+            totals[1] += duration
+            if kind == "http":
+                totals = self.endpoints.setdefault("{} {}".format(fields["method"], fields["endpoint"]), [0, 0.0])
+                totals[0] += 1
+                totals[1] += duration
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def summary(self, top: int = 10) -> str:
+        from tabulate import tabulate
+
+        wall = time.perf_counter() - self.start
+        lines = ["# Trace written to {}".format(self.path),
+                 "# Time per phase (summed over all jobs), wall time {:.1f}s:".format(wall)]
+        lines.append(tabulate(
+            [(phase, count, round(seconds, 2)) for phase, (count, seconds) in sorted(self.phases.items(), key=lambda item: -item[1][1])],
+            headers=["Phase", "Count", "Seconds"]))
+        if self.endpoints:
+            lines.append("# Top endpoints:")
+            endpoints = sorted(self.endpoints.items(), key=lambda item: -item[1][1])[:top]
+            lines.append(tabulate(
+                [(endpoint, count, round(seconds, 2), round(seconds / count * 1000)) for endpoint, (count, seconds) in endpoints],
+                headers=["Endpoint", "Requests", "Seconds", "Avg ms"]))
+        if self.repos:
+            slowest = max(self.repos, key=self.repos.get)
+            lines.append("# {} repository jobs, {:.1f}s on average, slowest {} ({:.1f}s)".format(
+                len(self.repos), sum(self.repos.values()) / len(self.repos), slowest, self.repos[slowest]))
+        return "\n".join(lines)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def start(path: str):
+    """Starts tracing to `path`. Git commands are traced by replacing `subprocess.Popen`."""
+    global _tracer
+    _tracer = Tracer(path)
+    subprocess.Popen = _TracedPopen
+
+
+def stop():
+    """Stops tracing and prints the summary."""
+    global _tracer
+    if _tracer is None:
+        return
+    tracer, _tracer = _tracer, None
+    subprocess.Popen = _Popen
+    tracer.close()
+    click.secho(tracer.summary(), fg="green")
+
+
+def active() -> bool:
+    return _tracer is not None
+
+
+def record(kind: str, started: float, duration: float, **fields):
+    if _tracer is not None:
+        _tracer.record(kind, started, duration, **fields)
+
+
+@contextmanager
+def phase(kind: str, **fields):
+    """Records the time spent in the block."""
+    if _tracer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, started, time.perf_counter() - started, **fields)
+
+
+_Popen = subprocess.Popen
+
+
+class _TracedPopen(_Popen):
+    def __init__(self, args, *posargs, **kwargs):
+        self._trace_started = time.perf_counter()
+        self._trace_recorded = False
+        super().__init__(args, *posargs, **kwargs)
+
+    def wait(self, timeout=None):
+        returncode = super().wait(timeout)
+        if not self._trace_recorded:
+            self._trace_recorded = True
+            args = self.args if isinstance(self.args, (list, tuple)) else str(self.args).split()
+            # Only the git subcommand; the other arguments can be long lists of names.
+            if args and str(args[0]).endswith("git"):
+                subcommand = next((str(a) for a in args[1:] if not str(a).startswith("-")), "")
+                record("git", self._trace_started, time.perf_counter() - self._trace_started,
+                       command="git " + subcommand, returncode=returncode)
+        return returncode
+
+
+_NUMBER = re.compile(r"^\d+$")
+# Segments after these names are identifiers, e.g. /repos/{owner}/{repo}/collaborators/{username}
+_NAMED_SEGMENTS = {"collaborators": "{username}", "members": "{username}", "outside_collaborators": "{username}"}
+
+
+def endpoint(url: str) -> str:
+    """Returns the endpoint template of a request URL, e.g.
+    `/repos/{owner}/{repo}/collaborators/{username}` for `/api/v3/repos/org/repo/collaborators/alice`.
+    """
+    path = urlparse(url).path
+    if path.startswith("/api/v3/"):
+        path = path[len("/api/v3"):]
+    parts = path.strip("/").split("/")
+    if parts[0] == "repos" and len(parts) >= 3:
+        parts[1:3] = ["{owner}", "{repo}"]
+        if len(parts) >= 5 and parts[3] == "branches":
+            end = len(parts) - 1 if parts[-1] == "protection" else len(parts)
+            parts[4:end] = ["{branch}"]
+    elif parts[0] in ("orgs", "users") and len(parts) >= 2:
+        parts[1] = "{org}" if parts[0] == "orgs" else "{username}"
+    for i in range(1, len(parts)):
+        if _NUMBER.match(parts[i]):
+            parts[i] = "{number}"
+        elif parts[i - 1] in _NAMED_SEGMENTS and not parts[i].startswith("{"):
+            parts[i] = _NAMED_SEGMENTS[parts[i - 1]]
+    return "/" + "/".join(parts)
+
@@ -1,21 +1,112 @@
 #!/usr/bin/env python3
+import mmap
+import re
 import subprocess
-from functools import wraps
-import sys
+import tarfile
+import threading
 import os
 import shutil
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import click
-import requests
-import jinja2
-import github as pygithub
 
-from .auth import needs_auth
+from .pool import jobs_option, run_per_repo
+import ghtt.pool
 
 @click.group()
 def util():
     pass
 
+# Number of bytes `grep-in` reads at once when the file isn't memory-mapped.
+GREP_CHUNK_SIZE = 1 << 20
+
+# Maximum number of nested groups in the regex of `grep-in`.
+GREP_MAX_NESTING = 100
+
+
+def _pattern_regex(strings: List[str]) -> "re.Pattern":
+    """Compiles the strings into one regex that follows a trie of the strings, like an Aho-Corasick
+    automaton. At each position of the text, it only follows the one branch that matches the next
+    byte, so all strings are matched in a single pass that runs inside the regex engine.
+
+    The regex engine compiles nested groups recursively, so when the trie would need more than
+    `GREP_MAX_NESTING` nested groups, a plain alternation of the strings is used instead.
+    """
+    encoded = [string.encode("utf-8") for string in strings]
+    trie: dict = {}
+    for string in encoded:
+        node = trie
+        for byte in string:
+            node = node.setdefault(byte, {})
+        node[None] = True
+
+    # Build the regex of each node after those of its children, without recursion, as long strings
+    # make deep tries. Returns the regex and the number of nested groups in it.
+    built: Dict[int, Tuple[bytes, int]] = {}
+    stack = [(trie, False)]
+    while stack:
+        node, children_built = stack.pop()
+        children = sorted(b for b in node if b is not None)
+        if not children_built:
+            stack.append((node, True))
+            stack.extend((node[byte], False) for byte in children)
+            continue
+        branches = [(re.escape(bytes([byte])) + built[id(node[byte])][0], built[id(node[byte])][1]) for byte in children]
+        for byte in children:
+            del built[id(node[byte])]
+        if not branches:
+            regex, depth = b"", 0
+        elif len(branches) == 1:
+            regex, depth = branches[0]
+        else:
+            regex = b"(?:" + b"|".join(regex for regex, _ in branches) + b")"
+            depth = max(depth for _, depth in branches) + 1
+        if None in node and branches:
+            # A string ends here; the longer ones are optional.
+            regex, depth = b"(?:" + regex + b")?", depth + 1
+        built[id(node)] = (regex, depth)
+
+    regex, depth = built[id(trie)]
+    if depth > GREP_MAX_NESTING:
+        regex = b"|".join(re.escape(string) for string in sorted(set(encoded), key=len, reverse=True))
+    return re.compile(regex)
+
+
+def _matching_lines(data, regex: "re.Pattern", start: int = 0) -> Iterator[bytes]:
+    """Yields each line of `data` that contains a match of `regex`, in order. `data` can be bytes or
+    a memory-mapped file.
+    """
+    position = start
+    while True:
+        match = regex.search(data, position)
+        if match is None:
+            return
+        # Lines never start before `start`, even if the newline before it is outside the range.
+        line_start = max(data.rfind(b"\n", start, match.start()) + 1, start)
+        line_end = data.find(b"\n", match.start())
+        if line_end == -1:
+            line_end = len(data)
+        yield data[line_start:line_end]
+        position = line_end + 1
+        if position >= len(data):
+            return
+
+
+def _stream_matching_lines(f, regex: "re.Pattern") -> Iterator[bytes]:
+    """Same as `_matching_lines`, but reads the file in chunks that end at a line break."""
+    rest = b""
+    while True:
+        chunk = f.read(GREP_CHUNK_SIZE)
+        if not chunk:
+            if rest:
+                yield from _matching_lines(rest, regex)
+            return
+        data = rest + chunk
+        end = data.rfind(b"\n") + 1
+        rest = data[end:]
+        yield from _matching_lines(data[:end], regex)
+
+
 @util.command()
 @click.argument("path", required="True")
 @click.argument("strings", required="True")
@@ -23,7 +114,11 @@ def util():
     '--no-header',
     help='Use this flag when you want to remove the header of a file.',
     is_flag=True)
-def grep_in(path, strings, no_header=False):
+@click.option(
+    '--mmap', 'use_mmap',
+    help='Memory-map the file instead of reading it in chunks.',
+    is_flag=True)
+def grep_in(path, strings, no_header=False, use_mmap=False):
     """Prints each line which contains one of the strings in the provided comma-separated list.
 
     FILENAME: name of file to search
@@ -31,18 +126,154 @@ def grep_in(path, strings, no_header=False):
     STRINGS: Comma-separated list of strings to search for
     """
     strings = strings.split(",")
+    regex = _pattern_regex(strings)
 
-    with open(path, "r") as f:
-        lines = f.readlines()
-
+    with open(path, "rb") as f:
+        header = b""
         if not no_header:
-            click.secho(lines.pop(0).strip())
+            header = f.readline()
+            click.secho(header.decode("utf-8", "replace").strip())
+
+        if use_mmap and os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                lines = _matching_lines(data, regex, start=len(header))
+                for line in lines:
+                    click.secho(line.decode("utf-8", "replace").strip())
+        else:
+            for line in _stream_matching_lines(f, regex):
+                click.secho(line.decode("utf-8", "replace").strip())
+
+
+def _commits_at(source: str, branches: List[str], at: str) -> Dict[str, Optional[str]]:
+    """Returns the last commit on the first-parent history of each branch that was committed before
+    `at`, or None if there is no such commit. The history of all branches is read in a single pass.
+    """
+    cutoff = subprocess.check_output(["git", "rev-parse", f"--before={at}"], cwd=source, universal_newlines=True)
+    cutoff = int(cutoff.strip().split("=", 1)[1])
 
-        for line in lines:
-            for string in strings:
-                if string in line:
-                    click.secho(line.strip())
-                    break
+    log = subprocess.check_output(
+        ["git", "rev-list", "--first-parent", "--timestamp", "--parents"] + [f"refs/heads/{b}" for b in branches] + ["--"],
+        cwd=source, universal_newlines=True)
+    commits = {}
+    for line in log.splitlines():
+        timestamp, sha, *parents = line.split()
+        commits[sha] = (int(timestamp), parents[0] if parents else None)
+
+    tips = subprocess.check_output(
+        ["git", "rev-parse"] + [f"refs/heads/{b}" for b in branches], cwd=source, universal_newlines=True).split()
+    result = {}
+    for branch, sha in zip(branches, tips):
+        while sha is not None and commits[sha][0] > cutoff:
+            sha = commits[sha][1]
+        result[branch] = sha
+    return result
+
+
+def _export_tree(source: str, commit: str, destination: str):
+    """Writes the files of `commit` to `destination`, without a repository."""
+    os.makedirs(destination)
+    archive = subprocess.Popen(["git", "archive", "--format=tar", commit], cwd=source, stdout=subprocess.PIPE)
+    with tarfile.open(fileobj=archive.stdout, mode="r|") as tar:
+        if hasattr(tarfile, "tar_filter"):
+            tar.extractall(destination, filter="tar")
+        else:
+            tar.extractall(destination)
+    if archive.wait() != 0:
+        raise subprocess.CalledProcessError(archive.returncode, archive.args)
+
+
+class _Deduplicator:
+    """Keeps track of the files written by `_export_tree_deduplicated`, so each blob is written to
+    disk only once and all other copies are hard links to it.
+    """
+    def __init__(self):
+        self.files: Dict[Tuple[str, str], Tuple[str, threading.Event]] = {}
+        self.written = 0
+        self.linked = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+
+    def claim(self, key: Tuple[str, str], path: str) -> Optional[Tuple[str, threading.Event]]:
+        """Returns None if `path` should be written, or the file to link to and the event that is
+        set once that file has been written.
+        """
+        with self._lock:
+            if key in self.files:
+                return self.files[key]
+            self.files[key] = (path, threading.Event())
+            return None
+
+    def count(self, size: int, linked: bool):
+        with self._lock:
+            if linked:
+                self.linked += 1
+                self.bytes_saved += size
+            else:
+                self.written += 1
+
+    def report(self) -> str:
+        return "# Wrote {} files and linked {} identical files, saving {:.1f} MB of disk space and writes".format(
+            self.written, self.linked, self.bytes_saved / 1e6)
+
+
+def _export_tree_deduplicated(source: str, commit: str, destination: str, deduplicator: _Deduplicator):
+    """Same as `_export_tree`, but files with the same content and mode as a file that was already
+    exported are hard links to that file.
+    """
+    os.makedirs(destination)
+    listing = subprocess.check_output(["git", "ls-tree", "-r", "-z", "--long", "--full-tree", commit], cwd=source)
+    to_write, to_link = [], []
+    for entry in listing.split(b"\0"):
+        if not entry:
+            continue
+        info, path = entry.split(b"\t", 1)
+        mode, kind, sha, size = info.decode().split()
+        path = os.path.join(destination, os.fsdecode(path))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if kind != "blob":
+            os.makedirs(path, exist_ok=True)  # a submodule; `git archive` leaves these empty too
+        elif mode == "120000":
+            to_write.append((sha, mode, path, None))
+        else:
+            original = deduplicator.claim((sha, mode), path)
+            if original is None:
+                to_write.append((sha, mode, path, deduplicator.files[(sha, mode)][1]))
+            else:
+                to_link.append((int(size), path, original))
+
+    # Write the new files first, so other exports waiting for them never wait on this one.
+    cat_file = subprocess.Popen(["git", "cat-file", "--batch"], cwd=source, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        for sha, mode, path, written in to_write:
+            cat_file.stdin.write(sha.encode() + b"\n")
+            cat_file.stdin.flush()
+            size = int(cat_file.stdout.readline().split()[2])
+            content = cat_file.stdout.read(size + 1)[:-1]
+            if mode == "120000":
+                os.symlink(os.fsdecode(content), path)
+                continue
+            with open(path, "wb") as f:
+                f.write(content)
+            if mode == "100755":
+                os.chmod(path, 0o755)
+            deduplicator.count(size, linked=False)
+            written.set()
+    finally:
+        cat_file.stdin.close()
+        cat_file.wait()
+        # Don't let other exports wait forever if this one failed; linking to a missing file fails.
+        for sha, mode, path, written in to_write:
+            if written is not None:
+                written.set()
+
+    for size, path, (original, written) in to_link:
+        written.wait()
+        try:
+            os.link(original, path)
+            deduplicator.count(size, linked=True)
+        except OSError:  # e.g. another file system, or too many links
+            shutil.copy2(original, path)
+            deduplicator.count(size, linked=False)
 
 
 @util.command()
@@ -54,9 +285,17 @@ def grep_in(path, strings, no_header=False):
     '--rm-repo', '-r',
     help="Use this flag when you only want the files without the repository",
     is_flag=True)
-def branches_to_folders(source, at=None, rm_repo=False):
+@click.option(
+    '--dedupe', '-d',
+    help="Store identical files only once, as hard links to each other. Requires --rm-repo. Editing such a file in place changes it in all folders.",
+    is_flag=True)
+@jobs_option
+def branches_to_folders(source, jobs, at=None, rm_repo=False, dedupe=False):
     """Expands a git repository so each branch is in a different folder.
 
+    The folders share the objects of the source repository instead of copying them, so keep the
+    source repository around. With --rm-repo, the folders only contain the files.
+
     SOURCE: path to git repository
     """
     source = os.path.abspath(source)
@@ -64,18 +303,38 @@ def branches_to_folders(source, at=None, rm_repo=False):
     branches = subprocess.check_output(["git", "for-each-ref", "--format=%(refname:short)", "refs/heads/*"], cwd=source, universal_newlines=True)
     branches = branches.strip().split("\n")
 
+    if dedupe and not rm_repo:
+        click.secho("ERROR: --dedupe only works together with --rm-repo.", fg="red")
+        return(False)
+
     if os.path.exists(f"{source}.expanded"):
         click.secho(f"ERROR: the path '{source}.expanded' already exists. Please remove that directory first.", fg="red")
         return(False)
     os.mkdir(f"{source}.expanded")
 
-    for branch in branches:
+    commits = {branch: None for branch in branches}
+    if at:
+        commits = _commits_at(source, branches, at)
+        for branch in [b for b in branches if commits[b] is None]:
+            click.secho(f"Warning: branch {branch} has no commits before {at}, skipping", fg="yellow")
+            branches.remove(branch)
+
+    deduplicator = _Deduplicator()
+
+    def export_branch(branch):
         destination = f"{source}.expanded/{branch}"
-        subprocess.check_call(["git", "clone", "--single-branch", "--branch", branch, source, destination])
-        if at:
-            commit = subprocess.check_output(["git", "rev-list", "-n", "1", "--first-parent", f"--before='{at}'", branch], cwd=destination)
-            commit = commit.decode(sys.stdout.encoding).rstrip()
-            subprocess.check_call(["git", "-c", "advice.detachedHead=false", "checkout", commit], cwd=destination)
+        if dedupe:
+            _export_tree_deduplicated(source, commits[branch] or f"refs/heads/{branch}", destination, deduplicator)
+            return
         if rm_repo:
-            shutil.rmtree(f"{destination}/.git")
+            _export_tree(source, commits[branch] or f"refs/heads/{branch}", destination)
+            return
+        # A shared clone uses the object store of the source instead of copying it.
+        ghtt.pool.check_call(["git", "clone", "--quiet", "--shared", "--single-branch", "--branch", branch, source, destination])
+        if commits[branch]:
+            ghtt.pool.check_call(["git", "-c", "advice.detachedHead=false", "checkout", "--quiet", commits[branch]], cwd=destination)
 
+    failures = run_per_repo(branches, export_branch, jobs=jobs, name=lambda branch: branch)
+    if dedupe:
+        click.secho(deduplicator.report(), fg="green")
+    ghtt.pool.exit_on_failures(failures)
@@ -35,9 +35,15 @@ setup(
         "Natural Language :: English",
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.5",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
         "License :: OSI Approved :: GNU Affero General Public License v3",
     ],
     install_requires=[r for r in read("requirements.txt").split('\n') if r.strip()],
-    python_requires='>=3.5',
+    # PyGithub 2.5 needs Python 3.8.
+    python_requires='>=3.8',
 )